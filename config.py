@@ -1,4 +1,6 @@
 import os
+import secrets
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -51,3 +53,134 @@ if _auth_users_raw:
         AUTHORIZED_USERS = set()
 
 ALLOW_ALL = os.getenv('ALLOW_ALL', 'false').lower() in {'1', 'true', 'yes', 'on'}
+
+# Segmented downloads for direct links: number of parallel Range connections,
+# minimum size (MB) before splitting is worth it, and retries per segment
+DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', '4'))
+DOWNLOAD_SEGMENT_MIN_SIZE = int(float(os.getenv('DOWNLOAD_SEGMENT_MIN_SIZE_MB', '8')) * 1024 * 1024)
+DOWNLOAD_SEGMENT_RETRIES = int(os.getenv('DOWNLOAD_SEGMENT_RETRIES', '3'))
+
+# Download journal: resume state for interrupted direct-link downloads.
+# Entries (and their partial files) older than JOURNAL_MAX_AGE_HOURS are dropped at startup,
+# as are yt-dlp partial downloads untouched for that long.
+DOWNLOAD_STATE_DIR = os.getenv('DOWNLOAD_STATE_DIR', os.path.join(tempfile.gettempdir(), 'tgbot-journal'))
+JOURNAL_MAX_AGE_HOURS = float(os.getenv('JOURNAL_MAX_AGE_HOURS', '24'))
+
+# Shared HTTP client pool (keep-alive connections reused across all requests)
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '32'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+
+# Write-behind disk stage: threads doing file writes, and how many 1MB chunks
+# may be queued per file before the network reader is paused (backpressure)
+DISK_WRITER_THREADS = int(os.getenv('DISK_WRITER_THREADS', '2'))
+DISK_WRITE_QUEUE_CHUNKS = int(os.getenv('DISK_WRITE_QUEUE_CHUNKS', '16'))
+
+# Upload size limits per delivery path. Cloud Bot API accepts 50MB, a local
+# telegram-bot-api server or the Pyrogram bridge accept up to MAX_FILE_SIZE_GB (2GB = 2000MiB).
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_UPLOAD_LIMIT = int(float(os.getenv('MAX_FILE_SIZE_GB', '2')) * 1000 * 1024 * 1024)
+
+# Pipelined download -> upload for direct links with a known Content-Length:
+# bytes go straight into the multipart upload through a PIPE_BUFFER_MB ring buffer,
+# without a temp file. Only used for files of at least PIPE_MIN_SIZE_MB.
+PIPE_UPLOADS = os.getenv('PIPE_UPLOADS', 'true').lower() in {'1', 'true', 'yes', 'on'}
+PIPE_BUFFER_SIZE = int(float(os.getenv('PIPE_BUFFER_MB', '8')) * 1024 * 1024)
+PIPE_MIN_SIZE = int(float(os.getenv('PIPE_MIN_SIZE_MB', '20')) * 1024 * 1024)
+
+# Delivery cache: source URL -> Telegram file_id, so repeated links are resent without downloading
+DELIVERY_CACHE_PATH = os.getenv('DELIVERY_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'tgbot-delivery-cache.sqlite3'))
+DELIVERY_CACHE_TTL_DAYS = float(os.getenv('DELIVERY_CACHE_TTL_DAYS', '30'))
+DELIVERY_CACHE_MAX_ENTRIES = int(os.getenv('DELIVERY_CACHE_MAX_ENTRIES', '5000'))
+
+# Job scheduler: global and per-user concurrent transfers, plus extra slots
+# reserved for small files (size known and <= SCHED_SMALL_FILE_MB)
+SCHED_MAX_ACTIVE = int(os.getenv('SCHED_MAX_ACTIVE', '3'))
+SCHED_PER_USER = int(os.getenv('SCHED_PER_USER', '1'))
+SCHED_FAST_LANE_SLOTS = int(os.getenv('SCHED_FAST_LANE_SLOTS', '1'))
+SCHED_SMALL_FILE_SIZE = int(float(os.getenv('SCHED_SMALL_FILE_MB', '50')) * 1024 * 1024)
+
+# Updates processed concurrently (updates from one chat still run in order)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))
+
+# Managed download storage: one directory per job under STORAGE_ROOT. Jobs reserve
+# their expected size up front; total reservations stay under STORAGE_QUOTA_GB and
+# at least STORAGE_MIN_FREE_MB stays free on the disk. Jobs that do not fit wait up
+# to STORAGE_WAIT_SECONDS for space, larger-than-possible ones are rejected.
+STORAGE_ROOT = os.getenv('STORAGE_ROOT', os.path.join(tempfile.gettempdir(), 'tgbot-work'))
+STORAGE_QUOTA = int(float(os.getenv('STORAGE_QUOTA_GB', '10')) * 1024 * 1024 * 1024)
+STORAGE_MIN_FREE = int(float(os.getenv('STORAGE_MIN_FREE_MB', '500')) * 1024 * 1024)
+STORAGE_WAIT_SECONDS = float(os.getenv('STORAGE_WAIT_SECONDS', '600'))
+
+# Extracted yt-dlp info dicts are reused for this long (format URLs expire)
+YTDLP_INFO_CACHE_TTL = float(os.getenv('YTDLP_INFO_CACHE_TTL', '600'))
+YTDLP_INFO_CACHE_MAX_ENTRIES = int(os.getenv('YTDLP_INFO_CACHE_MAX_ENTRIES', '256'))
+
+# yt-dlp jobs run in separate worker processes: at most YTDLP_WORKERS at once,
+# each terminated after YTDLP_TIMEOUT seconds
+YTDLP_WORKERS = int(os.getenv('YTDLP_WORKERS', '2'))
+YTDLP_TIMEOUT = int(os.getenv('YTDLP_TIMEOUT', '300'))
+
+# Native HLS (m3u8) downloads: parallel segment fetches, retries per segment,
+# and the tallest variant picked when the size budget allows
+HLS_CONCURRENCY = int(os.getenv('HLS_CONCURRENCY', '8'))
+HLS_SEGMENT_RETRIES = int(os.getenv('HLS_SEGMENT_RETRIES', '3'))
+HLS_MAX_HEIGHT = int(os.getenv('HLS_MAX_HEIGHT', '720'))
+
+# yt-dlp format planning: besides the delivery size limit, the chosen format must
+# download within FORMAT_ETA_BUDGET seconds at an assumed FORMAT_ASSUMED_RATE_MBPS
+FORMAT_ETA_BUDGET = float(os.getenv('FORMAT_ETA_BUDGET', '240'))
+FORMAT_ASSUMED_RATE = float(os.getenv('FORMAT_ASSUMED_RATE_MBPS', '40')) * 1000 * 1000 / 8
+
+# Progress message edits: at most PROGRESS_GLOBAL_RATE edits/second across all jobs,
+# and at least PROGRESS_MIN_INTERVAL seconds between edits of one message
+PROGRESS_GLOBAL_RATE = float(os.getenv('PROGRESS_GLOBAL_RATE', '20'))
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '3'))
+
+# ffprobe/ffmpeg helper processes running at once, and the probe deadline
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
+MEDIA_PROBE_TIMEOUT = float(os.getenv('MEDIA_PROBE_TIMEOUT', '30'))
+
+# Move a trailing moov box to the front of MP4 videos before upload, so
+# Telegram clients can start playback before the whole file has arrived
+FASTSTART_REMUX = os.getenv('FASTSTART_REMUX', 'true').lower() in {'1', 'true', 'yes', 'on'}
+FASTSTART_TIMEOUT = float(os.getenv('FASTSTART_TIMEOUT', '600'))
+
+# Video thumbnails come from the keyframe at this fraction of the duration
+THUMBNAIL_POSITION = float(os.getenv('THUMBNAIL_POSITION', '0.1'))
+
+# Bridge uploads: one Pyrogram client per session string (several connections on
+# one auth key risk AUTH_KEY_DUPLICATED and a revoked session), files uploading at
+# once across them, and files each client sends in parallel. More clients need
+# their own logins: comma-separated session strings in BRIDGE_EXTRA_SESSIONS.
+BRIDGE_SESSION_STRINGS = list(dict.fromkeys([TG_SESSION_STRING] + [
+    session.strip() for session in os.getenv('BRIDGE_EXTRA_SESSIONS', '').split(',') if session.strip()
+])) if TG_SESSION_STRING else []
+BRIDGE_MAX_UPLOADS = int(os.getenv('BRIDGE_MAX_UPLOADS', '4'))
+BRIDGE_TRANSMISSIONS = int(os.getenv('BRIDGE_TRANSMISSIONS', '4'))
+
+# Local Bot API server started with --local on the same machine: uploads pass
+# the file's path (file:// URI) instead of its bytes, so STORAGE_ROOT must be
+# readable by the server under the same path. Files the server keeps in its
+# --dir (BOT_API_DIR) are deleted after BOT_API_FILE_MAX_AGE_HOURS.
+BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', 'false').lower() in {'1', 'true', 'yes', 'on'}
+BOT_API_DIR = os.getenv('BOT_API_DIR', '/var/lib/telegram-bot-api')
+BOT_API_FILE_MAX_AGE = float(os.getenv('BOT_API_FILE_MAX_AGE_HOURS', '6')) * 3600
+BOT_API_SWEEP_INTERVAL = float(os.getenv('BOT_API_SWEEP_INTERVAL', '1800'))
+
+# Webhook mode (instead of long polling) when WEBHOOK_URL is set: Telegram, or
+# the local Bot API server, posts updates to WEBHOOK_URL + WEBHOOK_PATH, served
+# on WEBHOOK_PORT inside the bot process. Requests must carry WEBHOOK_SECRET
+# (a random one is generated per start when unset).
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram-webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Health server liveness: the event loop is checked every HEALTH_HEARTBEAT
+# seconds and reported unhealthy after lagging more than HEALTH_MAX_LOOP_LAG
+HEALTH_HEARTBEAT = float(os.getenv('HEALTH_HEARTBEAT', '1'))
+HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '5'))
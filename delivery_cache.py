@@ -0,0 +1,143 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+from config import DELIVERY_CACHE_PATH, DELIVERY_CACHE_TTL_DAYS, DELIVERY_CACHE_MAX_ENTRIES
+
+# Query parameters that never change which file a link points to
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igshid', 'si', 'feature', 'ref', 'ref_src', 'share_id'}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a source URL so trivially different links share one cache entry."""
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    netloc = host
+    if parsed.port and not ((scheme == 'http' and parsed.port == 80) or (scheme == 'https' and parsed.port == 443)):
+        netloc = f"{host}:{parsed.port}"
+    path = parsed.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+    query = [
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')
+    ]
+    return urlunparse((scheme, netloc, path, '', urlencode(sorted(query)), ''))
+
+
+class DeliveryCache:
+    """
+    Persistent map from normalized source URL to what Telegram already holds for
+    it: a file_id (resend instantly) or a bridge message (copy_message).
+    Entries expire after a TTL and the least recently used ones are evicted
+    above a size cap. Methods are blocking; call them via disk_writer.run_blocking.
+    """
+
+    def __init__(self, path: str = DELIVERY_CACHE_PATH,
+                 ttl_seconds: float = DELIVERY_CACHE_TTL_DAYS * 86400,
+                 max_entries: int = DELIVERY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS deliveries (
+                url TEXT PRIMARY KEY,
+                media_type TEXT NOT NULL,
+                file_id TEXT,
+                file_unique_id TEXT,
+                from_chat_id INTEGER,
+                message_id INTEGER,
+                file_name TEXT,
+                file_size INTEGER,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS deliveries_last_used ON deliveries(last_used)")
+        self._db.commit()
+
+    def get(self, url: str) -> Optional[dict]:
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT * FROM deliveries WHERE url = ?", (key,)).fetchone()
+            if row is None or now - row['created'] > self.ttl_seconds:
+                if row is not None:
+                    self._db.execute("DELETE FROM deliveries WHERE url = ?", (key,))
+                    self._db.commit()
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE deliveries SET last_used = ? WHERE url = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return dict(row)
+
+    def put(self, url: str, delivery: dict, file_name: str = None, file_size: int = None):
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """INSERT OR REPLACE INTO deliveries
+                   (url, media_type, file_id, file_unique_id, from_chat_id, message_id,
+                    file_name, file_size, created, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    key, delivery['media_type'], delivery.get('file_id'), delivery.get('file_unique_id'),
+                    delivery.get('from_chat_id'), delivery.get('message_id'),
+                    file_name, file_size, now, now,
+                ),
+            )
+            self.stores += 1
+            self._evict(now)
+            self._db.commit()
+
+    def remove(self, url: str):
+        with self._lock:
+            self._db.execute("DELETE FROM deliveries WHERE url = ?", (normalize_url(url),))
+            self._db.commit()
+
+    def _evict(self, now: float):
+        cursor = self._db.execute("DELETE FROM deliveries WHERE created < ?", (now - self.ttl_seconds,))
+        self.evictions += cursor.rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._db.execute(
+                "DELETE FROM deliveries WHERE url IN "
+                "(SELECT url FROM deliveries ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.evictions += cursor.rowcount
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
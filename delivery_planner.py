@@ -0,0 +1,125 @@
+import shutil
+from typing import Optional
+
+# sendPhoto refuses larger images; they go out as documents
+PHOTO_LIMIT = 10 * 1024 * 1024
+
+# Containers Telegram clients play inline (sendVideo with supports_streaming)
+STREAMABLE_VIDEO = ('mp4', 'mov')
+
+# Bytes read from the start of a file for sniffing
+SNIFF_BYTES = 512
+
+# MP4 major brands of audio-only files
+AUDIO_BRANDS = (b'M4A ', b'M4B ', b'M4P ', b'F4A ')
+
+
+class MediaType:
+    def __init__(self, kind: str, container: Optional[str] = None):
+        # 'video', 'audio', 'photo' or 'document'
+        self.kind = kind
+        self.container = container
+
+    def __repr__(self):
+        return f"MediaType({self.kind}, {self.container})"
+
+
+class DeliveryPlan:
+    def __init__(self, route: str, kind: str, split: bool = False, remux: bool = False,
+                 part_size: Optional[int] = None, reason: str = ''):
+        # 'bot_api' (upload over HTTP), 'local' (path hand-off) or 'bridge'
+        self.route = route
+        # send method: 'video', 'audio', 'photo' or 'document'
+        self.kind = kind
+        # Over every available limit: send as parts of at most part_size bytes
+        self.split = split
+        self.part_size = part_size
+        # Video in a container Telegram does not stream: stream-copy it into MP4 first
+        self.remux = remux
+        self.reason = reason
+
+    def __repr__(self):
+        flags = ''.join((', split' if self.split else '', ', remux' if self.remux else ''))
+        return f"DeliveryPlan({self.route}, {self.kind}{flags}: {self.reason})"
+
+
+def sniff(head: bytes) -> MediaType:
+    """Media type from a file's leading bytes (magic numbers), independent of its name."""
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in AUDIO_BRANDS:
+            return MediaType('audio', 'm4a')
+        return MediaType('video', 'mov' if brand == b'qt  ' else 'mp4')
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free'):
+        return MediaType('video', 'mov')
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return MediaType('video', 'webm' if b'webm' in head[:64] else 'mkv')
+    if head.startswith(b'RIFF'):
+        riff_type = head[8:12]
+        if riff_type == b'AVI ':
+            return MediaType('video', 'avi')
+        if riff_type == b'WAVE':
+            return MediaType('audio', 'wav')
+        if riff_type == b'WEBP':
+            return MediaType('photo', 'webp')
+    if head.startswith(b'FLV'):
+        return MediaType('video', 'flv')
+    if head[:1] == b'\x47' and head[188:189] == b'\x47':
+        return MediaType('video', 'ts')
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0 and head[1] & 0x06):
+        return MediaType('audio', 'mp3')
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return MediaType('audio', 'aac')
+    if head.startswith(b'fLaC'):
+        return MediaType('audio', 'flac')
+    if head.startswith(b'OggS'):
+        return MediaType('audio', 'ogg')
+    if head.startswith(b'\xff\xd8\xff'):
+        return MediaType('photo', 'jpeg')
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return MediaType('photo', 'png')
+    # GIFs, archives, text and everything unknown
+    return MediaType('document')
+
+
+def sniff_file(path: str) -> MediaType:
+    """sniff() on the start of `path` (blocking; call via disk_writer.run_blocking)."""
+    with open(path, 'rb') as f:
+        return sniff(f.read(SNIFF_BYTES))
+
+
+def plan_delivery(media: MediaType, size: int, api_limit: int, local_mode: bool = False,
+                  bridge_limit: Optional[int] = None) -> DeliveryPlan:
+    """
+    Decide how a file of `size` bytes goes out before anything is sent: which
+    route (Bot API upload, local path hand-off or the bridge account for files
+    over `api_limit`; `bridge_limit` None means no bridge), which send method
+    and whether it has to be split or remuxed first.
+    """
+    kind = media.kind
+    remux = False
+    reasons = []
+    if kind == 'photo' and size > PHOTO_LIMIT:
+        kind = 'document'
+        reasons.append('photo over 10MB')
+    if kind == 'video' and media.container not in STREAMABLE_VIDEO:
+        if shutil.which('ffmpeg'):
+            remux = True
+            reasons.append(f'{media.container} remuxed to mp4')
+        else:
+            kind = 'document'
+            reasons.append(f'{media.container} is not streamable')
+
+    if size <= api_limit:
+        route = 'local' if local_mode else 'bot_api'
+        reasons.append('within Bot API limit')
+        return DeliveryPlan(route, kind, remux=remux, reason=', '.join(reasons))
+    if bridge_limit and size <= bridge_limit:
+        reasons.append('over Bot API limit, bridge account')
+        return DeliveryPlan('bridge', kind, remux=remux, reason=', '.join(reasons))
+
+    part_size = max(api_limit, bridge_limit or 0)
+    reasons.append('over every limit, split')
+    # Parts are cut from the original file; the splitter keeps video parts playable
+    return DeliveryPlan('bridge' if bridge_limit else ('local' if local_mode else 'bot_api'),
+                        kind, split=True, part_size=part_size, reason=', '.join(reasons))
@@ -0,0 +1,119 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from config import DISK_WRITER_THREADS, DISK_WRITE_QUEUE_CHUNKS
+
+# Dedicated threads for blocking file I/O so the event loop never waits on the disk
+_executor = ThreadPoolExecutor(max_workers=DISK_WRITER_THREADS, thread_name_prefix="disk-writer")
+
+_CLOSE = object()
+
+
+async def run_blocking(func, *args):
+    """Run a blocking file-system call on the disk threads."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+class WriteBehindFile:
+    """
+    Write-behind file: write() only queues the chunk and returns, a writer task
+    applies queued chunks in order on the disk threads. The queue is bounded, so
+    when the disk falls behind write() blocks and the network reader slows down.
+
+    `offset=None` appends; an explicit offset uses pwrite (segmented downloads).
+    `on_written(offset, length)` runs on the disk thread after the bytes are written.
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None, truncate: bool = True,
+                 max_chunks: int = DISK_WRITE_QUEUE_CHUNKS):
+        self.path = path
+        self.size = size
+        self.truncate = truncate
+        self.fd: Optional[int] = None
+        self.bytes_written = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+        self._writer: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    def _open_sync(self):
+        flags = os.O_RDWR | os.O_CREAT
+        if self.truncate:
+            flags |= os.O_TRUNC
+        fd = os.open(self.path, flags, 0o644)
+        if self.size:
+            # Preallocate so parallel segments can write anywhere in the file
+            os.ftruncate(fd, self.size)
+        return fd
+
+    async def open(self) -> "WriteBehindFile":
+        self.fd = await run_blocking(self._open_sync)
+        self._writer = asyncio.create_task(self._drain())
+        return self
+
+    def _write_sync(self, data: bytes, offset: Optional[int], on_written: Optional[Callable]):
+        if offset is None:
+            view = memoryview(data)
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+        else:
+            view = memoryview(data)
+            position = offset
+            while view:
+                written = os.pwrite(self.fd, view, position)
+                view = view[written:]
+                position += written
+        if on_written:
+            on_written(offset, len(data))
+
+    async def _drain(self):
+        while True:
+            item = await self._queue.get()
+            if item is _CLOSE:
+                return
+            data, offset, on_written = item
+            if self._error is not None:
+                continue  # keep draining so blocked producers wake up
+            try:
+                await run_blocking(self._write_sync, data, offset, on_written)
+                self.bytes_written += len(data)
+            except BaseException as e:
+                self._error = e
+
+    async def write(self, data: bytes, offset: Optional[int] = None, on_written: Optional[Callable] = None):
+        if self._error is not None:
+            raise Exception(f"disk write failed for {self.path}: {self._error}")
+        await self._queue.put((bytes(data), offset, on_written))
+
+    async def close(self):
+        """Flush everything still queued, then close the file; re-raises a write error."""
+        if self._writer is not None:
+            await self._queue.put(_CLOSE)
+            await self._writer
+            self._writer = None
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            await run_blocking(os.close, fd)
+        if self._error is not None:
+            raise Exception(f"disk write failed for {self.path}: {self._error}")
+
+    async def abort(self):
+        """Stop writing (pending chunks are still applied) and close without raising."""
+        if self._writer is None and self.fd is None:
+            return
+        try:
+            await self.close()
+        except Exception as e:
+            print(f"⚠️ Error while closing {self.path}: {e}")
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import hashlib
+from typing import Optional
+
+from config import DOWNLOAD_STATE_DIR, JOURNAL_MAX_AGE_HOURS
+
+# Persist range progress at most this often while a transfer is running
+FLUSH_INTERVAL_SECONDS = 2
+
+
+def merge_ranges(ranges: list) -> list:
+    """Merge overlapping/adjacent inclusive [start, end] ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(completed: list, total_size: int) -> list:
+    """Return the inclusive [start, end] ranges of [0, total_size) not covered by `completed`."""
+    missing = []
+    position = 0
+    for start, end in merge_ranges(completed):
+        if start > position:
+            missing.append([position, start - 1])
+        position = max(position, end + 1)
+    if position < total_size:
+        missing.append([position, total_size - 1])
+    return missing
+
+
+class JournalEntry:
+    """Resume state of one direct-link download."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self._last_flush = 0.0
+
+    @property
+    def url(self) -> str:
+        return self.data['url']
+
+    @property
+    def file_path(self) -> str:
+        return self.data['file_path']
+
+    @property
+    def total_size(self) -> int:
+        return self.data['total_size']
+
+    @property
+    def completed(self) -> list:
+        return self.data['completed']
+
+    def completed_bytes(self) -> int:
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def validator(self) -> Optional[str]:
+        """Value suitable for an If-Range header (strong ETag preferred)."""
+        etag = self.data.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return self.data.get('last_modified')
+
+    def matches(self, total_size: int, etag: Optional[str], last_modified: Optional[str]) -> bool:
+        """True if the remote file still looks like the one we started downloading."""
+        if self.total_size != total_size:
+            return False
+        if self.data.get('etag') or etag:
+            return self.data.get('etag') == etag
+        if self.data.get('last_modified') or last_modified:
+            return self.data.get('last_modified') == last_modified
+        # No validators at all: size is the only thing we can compare
+        return True
+
+
+class DownloadJournal:
+    """
+    On-disk journal of in-progress downloads, one JSON file per URL.
+    Lets an interrupted transfer continue with Range requests after a
+    network error or a container restart instead of starting from zero.
+    """
+
+    def __init__(self, state_dir: str = DOWNLOAD_STATE_DIR):
+        self.state_dir = state_dir
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.state_dir, f"{key}.json")
+
+    def load(self, url: str) -> Optional[JournalEntry]:
+        try:
+            with open(self._path(url), 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('url') != url:
+            return None
+        return JournalEntry(data)
+
+    def resume_or_start(
+        self,
+        url: str,
+        file_path: str,
+        total_size: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> JournalEntry:
+        """Return a usable previous entry for `url`, or a fresh one (discarding stale partial data)."""
+        entry = self.load(url)
+        if entry and entry.matches(total_size, etag, last_modified) and os.path.exists(entry.file_path):
+            print(f"♻️ Resuming {url}: {entry.completed_bytes()} of {total_size} bytes already on disk")
+            return entry
+        if entry:
+            self.discard(entry)
+        entry = JournalEntry({
+            'url': url,
+            'file_path': file_path,
+            'total_size': total_size,
+            'etag': etag,
+            'last_modified': last_modified,
+            'completed': [],
+            'created': time.time(),
+        })
+        self.save(entry)
+        return entry
+
+    def record(self, entry: JournalEntry, start: int, end: int):
+        """Mark an inclusive byte range as written; flushes to disk at most every few seconds."""
+        entry.data['completed'] = merge_ranges(entry.completed + [[start, end]])
+        now = time.time()
+        if now - entry._last_flush >= FLUSH_INTERVAL_SECONDS:
+            self.save(entry)
+
+    def save(self, entry: JournalEntry):
+        entry.data['updated'] = time.time()
+        path = self._path(entry.url)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry.data, f)
+        os.replace(tmp_path, path)
+        entry._last_flush = entry.data['updated']
+
+    def finish(self, entry: JournalEntry):
+        """Download complete: forget the entry but keep the file."""
+        try:
+            os.unlink(self._path(entry.url))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, entry: JournalEntry):
+        """Forget the entry and delete its partial data."""
+        self.finish(entry)
+        try:
+            os.unlink(entry.file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Could not remove partial file {entry.file_path}: {e}")
+
+    def file_paths(self) -> list:
+        """Partial files still referenced by journal entries (must survive temp sweeps)."""
+        paths = []
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, name), 'r') as f:
+                    paths.append(json.load(f)['file_path'])
+            except Exception:
+                pass
+        return paths
+
+    def expire(self, max_age_hours: float = JOURNAL_MAX_AGE_HOURS) -> int:
+        """Drop entries (and their partial files) untouched for longer than `max_age_hours`."""
+        removed = 0
+        cutoff = time.time() - max_age_hours * 3600
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    entry = JournalEntry(json.load(f))
+                if entry.data.get('updated', 0) < cutoff:
+                    self.discard(entry)
+                    removed += 1
+            except Exception:
+                os.unlink(path)
+                removed += 1
+        if removed:
+            print(f"🗑️ Expired {removed} stale download journal entries")
+        return removed
@@ -0,0 +1,207 @@
+import re
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+from config import DOWNLOAD_SEGMENTS, DOWNLOAD_SEGMENT_MIN_SIZE, DOWNLOAD_SEGMENT_RETRIES
+from download_journal import DownloadJournal, JournalEntry, missing_ranges
+from disk_writer import WriteBehindFile, run_blocking
+
+CHUNK_SIZE = 1024 * 1024  # 1MB reads, same as the single-stream path
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class RemoteFileChanged(Exception):
+    """The server ignored If-Range because the file changed since the partial download."""
+
+
+class ProbeResult:
+    """What a short range request for the start of a direct link told us about it."""
+
+    def __init__(self, url: str, status: int, headers, total_size: int, accepts_ranges: bool, head: bytes = b''):
+        self.url = url
+        self.status = status
+        # Exposed as `headers` so helpers written for aiohttp responses
+        # (e.g. get_filename_from_response) accept a probe as well
+        self.headers = headers
+        self.total_size = total_size
+        self.accepts_ranges = accepts_ranges
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        # Leading bytes of the file (for content sniffing)
+        self.head = head
+
+    def can_segment(self, segments: int = DOWNLOAD_SEGMENTS) -> bool:
+        return self.accepts_ranges and segments > 1 and self.total_size >= DOWNLOAD_SEGMENT_MIN_SIZE
+
+
+def _parse_content_range_total(value: str | None) -> int:
+    """Return the full length from a `Content-Range: bytes a-b/total` header (0 if unknown)."""
+    if not value:
+        return 0
+    match = re.match(r'bytes\s+\d+-\d+/(\d+)', value.strip())
+    return int(match.group(1)) if match else 0
+
+
+async def _read_up_to(response, limit: int) -> bytes:
+    data = b''
+    while len(data) < limit:
+        chunk = await response.content.read(limit - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+async def probe(session: aiohttp.ClientSession, url: str, headers: Optional[dict] = None,
+                head_bytes: int = 0) -> ProbeResult:
+    """
+    Ask for the first byte only (or the first `head_bytes`, kept as `head` for
+    sniffing); a 206 reply proves the server honours Range requests.
+    """
+    req_headers = dict(headers or {})
+    req_headers['Range'] = f'bytes=0-{max(head_bytes, 1) - 1}'
+    async with session.get(url, headers=req_headers, allow_redirects=True) as response:
+        total_size = 0
+        accepts_ranges = False
+        head = b''
+        if response.status == 206:
+            total_size = _parse_content_range_total(response.headers.get('Content-Range'))
+            accepts_ranges = total_size > 0
+            head = await response.read()
+        else:
+            total_size = int(response.headers.get('content-length', 0) or 0)
+            if response.status == 200 and head_bytes:
+                # Server ignored the Range header: take the head, do not pull the whole body
+                head = await _read_up_to(response, head_bytes)
+            response.close()
+        return ProbeResult(str(response.url), response.status, response.headers, total_size, accepts_ranges,
+                           head[:head_bytes])
+
+
+def split_ranges(total_size: int, segments: int) -> list[tuple[int, int]]:
+    """Split [0, total_size) into `segments` inclusive byte ranges."""
+    segments = max(1, min(segments, total_size))
+    base = total_size // segments
+    ranges = []
+    start = 0
+    for i in range(segments):
+        end = total_size - 1 if i == segments - 1 else start + base - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def plan_ranges(missing: list, segments: int) -> list[tuple[int, int]]:
+    """Spread the still-missing ranges over `segments` connections by splitting the largest ones."""
+    ranges = [tuple(r) for r in missing]
+    while len(ranges) < segments:
+        ranges.sort(key=lambda r: r[1] - r[0])
+        start, end = ranges[-1]
+        if end - start + 1 < 2 * CHUNK_SIZE:
+            break
+        middle = start + (end - start + 1) // 2
+        ranges[-1:] = [(start, middle - 1), (middle, end)]
+    return sorted(ranges)
+
+
+async def _fetch_segment(session, url, writer, start, end, headers, counter, on_progress, total_size, on_written,
+                         validator=None):
+    """
+    Fetch one inclusive byte range through `writer`, resuming from the last written
+    byte on retry. With a `validator` (ETag or Last-Modified of the partial file)
+    every request carries If-Range, so a changed remote file is detected.
+    """
+    position = start
+    attempt = 0
+    while position <= end:
+        req_headers = dict(headers or {})
+        req_headers['Range'] = f'bytes={position}-{end}'
+        if validator:
+            req_headers['If-Range'] = validator
+        try:
+            async with session.get(url, headers=req_headers, allow_redirects=True) as response:
+                if response.status == 200 and validator:
+                    raise RemoteFileChanged(f"remote file changed (If-Range {validator} not honoured)")
+                if response.status != 206:
+                    raise Exception(f"HTTP {response.status} for range {position}-{end}")
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    chunk = chunk[:end - position + 1]
+                    # Queued for the disk thread; blocks here only when the disk falls behind
+                    await writer.write(chunk, position, on_written)
+                    position += len(chunk)
+                    counter[0] += len(chunk)
+                    if on_progress:
+                        await on_progress(counter[0], total_size)
+                    if position > end:
+                        break
+            if position <= end:
+                raise Exception(f"connection closed early at byte {position} of range {start}-{end}")
+        except (asyncio.CancelledError, RemoteFileChanged):
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt > DOWNLOAD_SEGMENT_RETRIES:
+                raise Exception(f"segment {start}-{end} failed after {DOWNLOAD_SEGMENT_RETRIES} retries: {e}")
+            wait_time = 2 ** attempt
+            print(f"⚠️ Segment {start}-{end} failed at byte {position} ({e}); retry {attempt} in {wait_time}s")
+            await asyncio.sleep(wait_time)
+
+
+async def download_segmented(
+    session: aiohttp.ClientSession,
+    url: str,
+    file_path: str,
+    total_size: int,
+    segments: int = DOWNLOAD_SEGMENTS,
+    on_progress: Optional[ProgressCallback] = None,
+    headers: Optional[dict] = None,
+    journal: Optional[DownloadJournal] = None,
+    entry: Optional[JournalEntry] = None,
+) -> int:
+    """
+    Download `url` as `segments` parallel byte ranges into a preallocated file.
+    `on_progress(downloaded, total)` receives the combined byte count of all segments.
+    With a journal entry, ranges already on disk are skipped and new ones are recorded.
+    """
+    resuming = bool(entry and entry.completed)
+    if resuming:
+        ranges = plan_ranges(missing_ranges(entry.completed, total_size), segments)
+        counter = [entry.completed_bytes()]
+    else:
+        ranges = split_ranges(total_size, segments)
+        counter = [0]
+
+    if journal and entry:
+        # Runs on the disk thread, so a range is journaled only once its bytes are on disk
+        def on_written(offset, length):
+            journal.record(entry, offset, offset + length - 1)
+    else:
+        on_written = None
+
+    validator = entry.validator() if entry else None
+    writer = await WriteBehindFile(file_path, size=total_size, truncate=not resuming).open()
+    try:
+        tasks = [
+            asyncio.create_task(
+                _fetch_segment(session, url, writer, start, end, headers, counter, on_progress, total_size, on_written,
+                               validator)
+            )
+            for start, end in ranges
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        await writer.close()
+    finally:
+        await writer.abort()
+        if journal and entry:
+            await run_blocking(journal.save, entry)
+    print(f"✅ Ranged download finished: {len(ranges)} connections, {total_size} bytes")
+    return total_size
@@ -0,0 +1,110 @@
+import re
+import shutil
+from typing import Optional
+
+from config import FORMAT_ETA_BUDGET, FORMAT_ASSUMED_RATE
+
+# Container overhead and bitrate jitter on top of bitrate x duration estimates
+ESTIMATE_MARGIN = 1.1
+
+
+class FormatPlan:
+    def __init__(self, format_spec: str, height: Optional[int], size: Optional[int], fits: bool):
+        self.format_spec = format_spec
+        self.height = height
+        self.size = size
+        # False when even the smallest candidate is over the limit
+        self.fits = fits
+
+    def __repr__(self):
+        size = f"{self.size / (1024 * 1024):.1f}MB" if self.size else "unknown size"
+        return f"FormatPlan({self.format_spec}, {self.height}p, {size}, fits={self.fits})"
+
+
+def max_height_from_spec(format_spec: Optional[str]) -> Optional[int]:
+    """Height cap of a yt-dlp format string like 'best[height<=720]/best'."""
+    match = re.search(r'height\s*<=\s*(\d+)', format_spec or '')
+    return int(match.group(1)) if match else None
+
+
+def estimate_size(fmt: dict, duration: Optional[float]) -> Optional[int]:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration * ESTIMATE_MARGIN)
+    return None
+
+
+def _has_video(fmt: dict) -> bool:
+    return fmt.get('vcodec') not in (None, 'none') or (fmt.get('height') and fmt.get('vcodec') is None)
+
+
+def _has_audio(fmt: dict) -> bool:
+    return fmt.get('acodec') not in (None, 'none')
+
+
+def candidates(info: dict, max_height: Optional[int] = None) -> list:
+    """(format_spec, height, estimated_size, tbr) for every playable choice, best first."""
+    formats = info.get('formats') or []
+    duration = info.get('duration')
+    result = []
+    audio_only = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    best_audio = max(audio_only, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+    can_merge = best_audio is not None and shutil.which('ffmpeg') is not None
+    for fmt in formats:
+        if not _has_video(fmt) or not fmt.get('format_id'):
+            continue
+        height = fmt.get('height')
+        if max_height and height and height > max_height:
+            continue
+        size = estimate_size(fmt, duration)
+        if _has_audio(fmt) or fmt.get('acodec') is None:
+            result.append((fmt['format_id'], height, size, fmt.get('tbr') or 0))
+        elif can_merge:
+            audio_size = estimate_size(best_audio, duration)
+            total = size + audio_size if size and audio_size else None
+            tbr = (fmt.get('tbr') or 0) + (best_audio.get('tbr') or best_audio.get('abr') or 0)
+            result.append((f"{fmt['format_id']}+{best_audio['format_id']}", height, total, tbr))
+    result.sort(key=lambda c: (c[1] or 0, c[3]), reverse=True)
+    return result
+
+
+def plan_format(info: dict, size_limit: int, max_height: Optional[int] = None,
+                eta_budget: float = FORMAT_ETA_BUDGET, assumed_rate: float = FORMAT_ASSUMED_RATE) -> Optional[FormatPlan]:
+    """
+    Best format of `info` whose (estimated) size fits `size_limit` and downloads
+    within `eta_budget` seconds at `assumed_rate` bytes/s. Lower resolutions are
+    only chosen when the better ones do not fit. None if the info dict has no
+    format list to choose from.
+    """
+    choices = candidates(info, max_height)
+    if not choices:
+        return None
+    budget = size_limit
+    if eta_budget and assumed_rate:
+        budget = min(budget, int(eta_budget * assumed_rate))
+    for spec, height, size, _ in choices:
+        if size is not None and size <= budget:
+            return FormatPlan(spec, height, size, True)
+    known = [c for c in choices if c[2] is not None]
+    if not known:
+        # No sizes to reason about: keep the site's default choice
+        return None
+    spec, height, size, _ = min(known, key=lambda c: c[2])
+    return FormatPlan(spec, height, size, size <= size_limit)
+
+
+def media_hint(info: dict, format_spec: Optional[str] = None) -> dict:
+    """Width/height/duration of the video that `format_spec` (or yt-dlp's own choice) downloads."""
+    if format_spec:
+        by_id = {f.get('format_id'): f for f in info.get('formats') or []}
+        chosen = [by_id[part] for part in format_spec.split('+') if part in by_id]
+        video = next((f for f in chosen if _has_video(f)), info)
+    else:
+        video = next((f for f in info.get('requested_formats') or [] if _has_video(f)), info)
+    return {
+        'width': video.get('width') or info.get('width'),
+        'height': video.get('height') or info.get('height'),
+        'duration': info.get('duration'),
+    }
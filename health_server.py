@@ -1,54 +1,141 @@
 #!/usr/bin/env python3
 """
-Simple HTTP health check server for UptimeBot monitoring
-Runs alongside the Telegram bot
+HTTP health check and metrics server for UptimeBot monitoring and Prometheus
+Runs on the bot's own event loop
 """
 
-import threading
 import time
-from flask import Flask, jsonify
+import asyncio
+from collections import deque
 from datetime import datetime
 
+from aiohttp import web
+
+from config import HEALTH_HEARTBEAT, HEALTH_MAX_LOOP_LAG
+from metrics import REGISTRY
+
+# Heartbeats whose lag is remembered for the liveness check
+LAG_WINDOW = 30
+
+
 class HealthServer:
-    def __init__(self, port=8080):
-        self.app = Flask(__name__)
+    """
+    Health endpoints served by aiohttp on the bot's event loop. A heartbeat task
+    measures how late the loop wakes up; /health answers 503 while the loop was
+    recently blocked for more than `max_lag` seconds (and does not answer at all
+    while it is blocked), so it reflects whether the bot can actually work.
+    """
+
+    def __init__(self, port=8080, heartbeat: float = HEALTH_HEARTBEAT, max_lag: float = HEALTH_MAX_LOOP_LAG):
         self.port = port
+        self.heartbeat = heartbeat
+        self.max_lag = max_lag
         self.start_time = datetime.now()
         self.bot_status = "starting"
+        # name -> callable returning a dict, reported under "stats"
+        self.stats_providers = {}
+        self.loop_lag = 0.0
+        self._lags: deque = deque(maxlen=LAG_WINDOW)
+        self._last_beat = time.monotonic()
+        self._heartbeat_task = None
+        self._runner = None
+        self.app = web.Application()
         self.setup_routes()
-    
+
     def setup_routes(self):
-        @self.app.route('/')
-        def health_check():
-            uptime = datetime.now() - self.start_time
-            return jsonify({
-                "status": "healthy",
-                "bot_status": self.bot_status,
-                "uptime_seconds": int(uptime.total_seconds()),
-                "uptime": str(uptime).split('.')[0],
-                "timestamp": datetime.now().isoformat(),
-                "message": "Telegram Download Bot is running"
-            })
-        
-        @self.app.route('/health')
-        def health():
-            return jsonify({"status": "ok", "bot_status": self.bot_status})
-        
-        @self.app.route('/ping')
-        def ping():
-            return "pong"
-    
+        self.app.router.add_get('/', self.health_check)
+        self.app.router.add_get('/health', self.health)
+        self.app.router.add_get('/ping', self.ping)
+        self.app.router.add_get('/stats', self.stats)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def health_check(self, request):
+        uptime = datetime.now() - self.start_time
+        return web.json_response({
+            "status": "healthy" if self.is_alive() else "unhealthy",
+            "bot_status": self.bot_status,
+            "uptime_seconds": int(uptime.total_seconds()),
+            "uptime": str(uptime).split('.')[0],
+            "timestamp": datetime.now().isoformat(),
+            "message": "Telegram Download Bot is running",
+            "event_loop_lag_seconds": round(self.recent_lag(), 3),
+            "stats": self.collect_stats()
+        }, status=200 if self.is_alive() else 503)
+
+    async def health(self, request):
+        alive = self.is_alive()
+        return web.json_response({
+            "status": "ok" if alive else "event loop lagging",
+            "bot_status": self.bot_status,
+            "event_loop_lag_seconds": round(self.recent_lag(), 3),
+        }, status=200 if alive else 503)
+
+    async def ping(self, request):
+        return web.Response(text="pong")
+
+    async def stats(self, request):
+        return web.json_response(self.collect_stats())
+
+    async def metrics(self, request):
+        body = REGISTRY.render(self.stats_providers, {
+            'up': 1 if self.is_alive() else 0,
+            'uptime_seconds': int((datetime.now() - self.start_time).total_seconds()),
+            'event_loop_lag_seconds': round(self.loop_lag, 4),
+            'event_loop_lag_max_seconds': round(self.recent_lag(), 4),
+        })
+        return web.Response(text=body, content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
     def update_bot_status(self, status):
         """Update bot status for health checks"""
         self.bot_status = status
-    
-    def start(self):
-        """Start the health server in a separate thread"""
-        def run_server():
-            # Bind to all interfaces for external accessibility (UptimeRobot monitoring)
-            self.app.run(host='0.0.0.0', port=self.port, debug=False, use_reloader=False)
-        
-        server_thread = threading.Thread(target=run_server, daemon=True)
-        server_thread.start()
+
+    def add_stats_provider(self, name, provider):
+        """Register a callable whose dict result is reported under /stats and /metrics"""
+        self.stats_providers[name] = provider
+
+    def collect_stats(self):
+        stats = {}
+        for name, provider in self.stats_providers.items():
+            try:
+                stats[name] = provider()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return stats
+
+    def recent_lag(self) -> float:
+        """Worst loop lag over the last heartbeats, counting a heartbeat that is overdue right now."""
+        overdue = time.monotonic() - self._last_beat - self.heartbeat
+        return max([overdue, *self._lags]) if self._lags else max(overdue, 0.0)
+
+    def is_alive(self) -> bool:
+        return self.recent_lag() <= self.max_lag
+
+    async def _beat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.heartbeat)
+            now = time.monotonic()
+            self.loop_lag = max(0.0, now - before - self.heartbeat)
+            self._lags.append(self.loop_lag)
+            self._last_beat = now
+            if self.loop_lag > self.max_lag:
+                print(f"⚠️ Event loop was blocked for {self.loop_lag:.1f}s")
+
+    async def start(self):
+        """Start serving on the running event loop"""
+        self._last_beat = time.monotonic()
+        self._heartbeat_task = asyncio.create_task(self._beat())
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        # Bind to all interfaces for external accessibility (UptimeRobot monitoring)
+        await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
         print(f"🌐 Health server started on port {self.port} (accessible externally)")
-        return server_thread
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
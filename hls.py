@@ -0,0 +1,257 @@
+import re
+import asyncio
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+from config import HLS_CONCURRENCY, HLS_SEGMENT_RETRIES, HLS_MAX_HEIGHT
+from disk_writer import WriteBehindFile
+
+ProgressCallback = Callable[[int, int, int], Awaitable[None]]
+
+HLS_CONTENT_TYPES = ('application/vnd.apple.mpegurl', 'application/x-mpegurl', 'audio/mpegurl', 'audio/x-mpegurl')
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HlsUnsupported(Exception):
+    """Playlist needs something this engine does not do (encryption, live streams)."""
+
+
+def is_hls_url(url: str) -> bool:
+    return urlparse(url).path.lower().endswith('.m3u8')
+
+
+def is_hls_content_type(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(';')[0].strip().lower() in HLS_CONTENT_TYPES
+
+
+def parse_attributes(text: str) -> dict:
+    return {key: value.strip('"') for key, value in _ATTRIBUTE_RE.findall(text)}
+
+
+class Variant:
+    def __init__(self, url: str, bandwidth: int, height: Optional[int], codecs: Optional[str],
+                 separate_audio: bool = False):
+        self.url = url
+        self.bandwidth = bandwidth
+        self.height = height
+        self.codecs = codecs
+        # Audio comes from its own rendition playlist (not muxed into the segments)
+        self.separate_audio = separate_audio
+
+    def __repr__(self):
+        return f"Variant({self.height}p, {self.bandwidth // 1000}kbps)"
+
+
+class Segment:
+    def __init__(self, url: str, duration: float, byterange: Optional[tuple] = None):
+        self.url = url
+        self.duration = duration
+        # (offset, length) for EXT-X-BYTERANGE sub-ranges of one file
+        self.byterange = byterange
+
+    @property
+    def headers(self) -> dict:
+        if not self.byterange:
+            return {}
+        offset, length = self.byterange
+        return {'Range': f'bytes={offset}-{offset + length - 1}'}
+
+
+class MediaPlaylist:
+    def __init__(self):
+        self.segments: list = []
+        self.init_segment: Optional[Segment] = None
+        self.encryption: Optional[str] = None
+        self.endlist = False
+
+    @property
+    def duration(self) -> float:
+        return sum(segment.duration for segment in self.segments)
+
+
+def parse_master(text: str, base_url: str) -> list:
+    """Variants of a master playlist (empty list if it is a media playlist)."""
+    variants = []
+    lines = [line.strip() for line in text.splitlines()]
+    audio_groups = set()
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA:'):
+            attributes = parse_attributes(line.split(':', 1)[1])
+            if attributes.get('TYPE') == 'AUDIO' and attributes.get('URI'):
+                audio_groups.add(attributes.get('GROUP-ID'))
+    for index, line in enumerate(lines):
+        if not line.startswith('#EXT-X-STREAM-INF:'):
+            continue
+        attributes = parse_attributes(line.split(':', 1)[1])
+        uri = next((l for l in lines[index + 1:] if l and not l.startswith('#')), None)
+        if not uri:
+            continue
+        height = None
+        resolution = attributes.get('RESOLUTION', '')
+        if 'x' in resolution:
+            try:
+                height = int(resolution.split('x')[1])
+            except ValueError:
+                pass
+        variants.append(Variant(
+            urljoin(base_url, uri),
+            int(attributes.get('BANDWIDTH', attributes.get('AVERAGE-BANDWIDTH', 0)) or 0),
+            height,
+            attributes.get('CODECS'),
+            attributes.get('AUDIO') in audio_groups,
+        ))
+    return variants
+
+
+def parse_media(text: str, base_url: str) -> MediaPlaylist:
+    playlist = MediaPlaylist()
+    duration = 0.0
+    byterange = None
+    next_offset = 0
+    for line in (line.strip() for line in text.splitlines()):
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line.split(':', 1)[1].partition('@')
+            start = int(offset) if offset else next_offset
+            byterange = (start, int(length))
+            next_offset = start + int(length)
+        elif line.startswith('#EXT-X-KEY:'):
+            method = parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE')
+            if method != 'NONE':
+                playlist.encryption = method
+        elif line.startswith('#EXT-X-MAP:'):
+            attributes = parse_attributes(line.split(':', 1)[1])
+            map_range = None
+            if 'BYTERANGE' in attributes:
+                length, _, offset = attributes['BYTERANGE'].partition('@')
+                map_range = (int(offset or 0), int(length))
+            playlist.init_segment = Segment(urljoin(base_url, attributes['URI']), 0, map_range)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist.endlist = True
+        elif not line.startswith('#'):
+            playlist.segments.append(Segment(urljoin(base_url, line), duration, byterange))
+            duration = 0.0
+            byterange = None
+    return playlist
+
+
+def pick_variant(variants: list, max_height: Optional[int] = HLS_MAX_HEIGHT) -> list:
+    """Candidates best-first: highest bandwidth within `max_height`, then the rest from the top."""
+    ordered = sorted(variants, key=lambda v: v.bandwidth, reverse=True)
+    within = [v for v in ordered if not max_height or not v.height or v.height <= max_height]
+    return within + [v for v in ordered if v not in within]
+
+
+class HlsDownloader:
+    """
+    Downloads a VOD HLS stream: resolves master -> media playlist (choosing the
+    best variant that fits the size budget), fetches segments in parallel with
+    retries and appends them in order to one file (the caller stream-copies it
+    into an MP4 with MediaTools.remux_mp4). At most `concurrency` segments are
+    in memory at once.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, headers: Optional[dict] = None,
+                 concurrency: int = HLS_CONCURRENCY, retries: int = HLS_SEGMENT_RETRIES):
+        self.session = session
+        self.headers = headers or {}
+        self.concurrency = concurrency
+        self.retries = retries
+
+    async def _get_text(self, url: str) -> tuple:
+        async with self.session.get(url, headers=self.headers, allow_redirects=True) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status} for playlist")
+            return await response.text(), str(response.url)
+
+    async def resolve(self, url: str, size_budget: Optional[int] = None) -> tuple:
+        """Return (media_playlist, variant or None) for a master or media playlist URL."""
+        text, final_url = await self._get_text(url)
+        if not text.lstrip().startswith('#EXTM3U'):
+            raise HlsUnsupported("not an m3u8 playlist")
+        variants = parse_master(text, final_url)
+        if not variants:
+            return self._check(parse_media(text, final_url)), None
+        if any(variant.separate_audio for variant in variants):
+            raise HlsUnsupported("audio in separate renditions")
+        fallback = None
+        for variant in pick_variant(variants):
+            media_text, media_url = await self._get_text(variant.url)
+            playlist = self._check(parse_media(media_text, media_url))
+            estimate = variant.bandwidth / 8 * playlist.duration
+            if not size_budget or not variant.bandwidth or estimate <= size_budget:
+                return playlist, variant
+            fallback = (playlist, variant)
+        # Nothing fits: take the smallest variant and let the delivery step deal with it
+        smallest = min(variants, key=lambda v: v.bandwidth)
+        if fallback and fallback[1] is smallest:
+            return fallback
+        media_text, media_url = await self._get_text(smallest.url)
+        return self._check(parse_media(media_text, media_url)), smallest
+
+    @staticmethod
+    def _check(playlist: MediaPlaylist) -> MediaPlaylist:
+        if playlist.encryption:
+            raise HlsUnsupported(f"encrypted stream ({playlist.encryption})")
+        if not playlist.endlist:
+            raise HlsUnsupported("live stream")
+        if not playlist.segments:
+            raise HlsUnsupported("empty playlist")
+        return playlist
+
+    async def _fetch(self, segment: Segment) -> bytes:
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(segment.url, headers={**self.headers, **segment.headers},
+                                            allow_redirects=True) as response:
+                    if response.status not in (200, 206):
+                        raise Exception(f"HTTP {response.status} for segment")
+                    return await response.read()
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise Exception(f"segment failed after {self.retries + 1} attempts: {e}")
+                await asyncio.sleep(min(2 ** attempt, 10))
+
+    async def download_segments(self, playlist: MediaPlaylist, file_path: str,
+                                on_progress: Optional[ProgressCallback] = None) -> int:
+        """Fetch all segments into `file_path` in playlist order; returns bytes written."""
+        total = len(playlist.segments)
+        # A permit is held from fetch start until the segment is written; waiters are
+        # served in creation (playlist) order, so the next segment to write always has one
+        window = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(segment):
+            await window.acquire()
+            try:
+                return await self._fetch(segment)
+            except BaseException:
+                window.release()
+                raise
+
+        tasks = [asyncio.create_task(fetch(segment)) for segment in playlist.segments]
+        written = 0
+        try:
+            async with WriteBehindFile(file_path) as out:
+                if playlist.init_segment:
+                    data = await self._fetch(playlist.init_segment)
+                    await out.write(data)
+                    written += len(data)
+                for index, task in enumerate(tasks):
+                    data = await task
+                    await out.write(data)
+                    written += len(data)
+                    window.release()
+                    if on_progress:
+                        await on_progress(index + 1, total, written)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return written
+
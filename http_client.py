@@ -0,0 +1,182 @@
+import aiohttp
+
+from config import (
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+)
+
+CHROME_91_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+CHROME_120_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Named request profiles: default headers and timeouts used by the extractors.
+# Per-request extras (Referer, cookies, ssl=False) are passed at call time.
+PROFILES = {
+    # Direct file downloads: no overall deadline, only connect
+    'download': {
+        'headers': {},
+        'timeout': aiohttp.ClientTimeout(total=None, connect=30),
+    },
+    # Streamed multipart uploads to the Bot API: large bodies, no overall deadline
+    'upload': {
+        'headers': {},
+        'timeout': aiohttp.ClientTimeout(total=None, connect=30),
+    },
+    # HTML pages we scrape for media URLs (qombol)
+    'page': {
+        'headers': {
+            'User-Agent': CHROME_91_UA,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        },
+        'timeout': aiohttp.ClientTimeout(total=30, connect=10),
+    },
+    # mediadelivery.net embed pages
+    'embed': {
+        'headers': {
+            'User-Agent': CHROME_91_UA,
+            'Referer': 'https://www.qombol.com/',
+        },
+        'timeout': aiohttp.ClientTimeout(total=30, connect=10),
+    },
+    # Quick HEAD/GET checks against video CDNs (Referer is set per request)
+    'cdn_check': {
+        'headers': {
+            'User-Agent': CHROME_91_UA,
+            'Origin': 'https://iframe.mediadelivery.net',
+            'Accept': '*/*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Sec-Fetch-Dest': 'video',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'cross-site',
+        },
+        'timeout': aiohttp.ClientTimeout(total=10, connect=5),
+    },
+    # Following share/short-link redirects (Reddit)
+    'resolve': {
+        'headers': {},
+        'timeout': aiohttp.ClientTimeout(total=15, connect=5),
+    },
+    # Browser-like navigation for sites behind bot protection (Rule34)
+    'browser': {
+        'headers': {
+            'User-Agent': CHROME_120_UA,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'none',
+            'Sec-Fetch-User': '?1',
+            'Cache-Control': 'max-age=0',
+        },
+        'timeout': aiohttp.ClientTimeout(total=60, connect=30),
+    },
+}
+
+
+class HttpClient:
+    """
+    Application-wide HTTP client: one keep-alive connection pool with a DNS
+    cache and per-host limits, shared by one aiohttp session per profile.
+    Call start() from a running event loop and close() on shutdown.
+    """
+
+    def __init__(self):
+        self.connector: aiohttp.TCPConnector | None = None
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._trace = aiohttp.TraceConfig()
+        self._trace.on_request_start.append(self._on_request_start)
+        self._trace.on_connection_create_end.append(self._on_connection_create)
+        self._trace.on_connection_reuseconn.append(self._on_connection_reuse)
+        self._trace.on_dns_cache_hit.append(self._on_dns_hit)
+        self._trace.on_dns_cache_miss.append(self._on_dns_miss)
+        self._stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+        }
+
+    async def start(self):
+        if self.connector is not None:
+            return
+        self.connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        print(f"🌐 HTTP pool ready (limit={HTTP_POOL_LIMIT}, per_host={HTTP_POOL_LIMIT_PER_HOST}, dns_ttl={HTTP_DNS_CACHE_TTL}s)")
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+        print("🌐 HTTP pool closed")
+
+    def _new_session(self, profile: str, cookie_jar=None) -> aiohttp.ClientSession:
+        if self.connector is None:
+            raise RuntimeError("HTTP client not started")
+        settings = PROFILES[profile]
+        return aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            headers=settings['headers'],
+            timeout=settings['timeout'],
+            # Shared sessions must not carry one user's cookies into another's request
+            cookie_jar=cookie_jar if cookie_jar is not None else aiohttp.DummyCookieJar(),
+            trace_configs=[self._trace],
+        )
+
+    def session(self, profile: str = 'download') -> aiohttp.ClientSession:
+        """Shared, long-lived session for `profile`. Do not close it."""
+        session = self._sessions.get(profile)
+        if session is None or session.closed:
+            session = self._new_session(profile)
+            self._sessions[profile] = session
+        return session
+
+    def cookie_session(self, profile: str, cookie_jar: aiohttp.CookieJar) -> aiohttp.ClientSession:
+        """
+        Short-lived session with its own cookie jar that still uses the shared
+        connection pool. Use it as `async with`; closing it keeps the pool open.
+        """
+        return self._new_session(profile, cookie_jar=cookie_jar)
+
+    async def _on_request_start(self, session, ctx, params):
+        self._stats['requests'] += 1
+
+    async def _on_connection_create(self, session, ctx, params):
+        self._stats['connections_created'] += 1
+
+    async def _on_connection_reuse(self, session, ctx, params):
+        self._stats['connections_reused'] += 1
+
+    async def _on_dns_hit(self, session, ctx, params):
+        self._stats['dns_cache_hits'] += 1
+
+    async def _on_dns_miss(self, session, ctx, params):
+        self._stats['dns_cache_misses'] += 1
+
+    def stats(self) -> dict:
+        """Pool counters plus the share of requests that reused a kept-alive connection."""
+        stats = dict(self._stats)
+        opened = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_rate'] = round(stats['connections_reused'] / opened, 3) if opened else 0.0
+        if self.connector is not None:
+            stats['limit'] = self.connector.limit
+            stats['limit_per_host'] = self.connector.limit_per_host
+        return stats
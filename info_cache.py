@@ -0,0 +1,62 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import YTDLP_INFO_CACHE_TTL, YTDLP_INFO_CACHE_MAX_ENTRIES
+from delivery_cache import normalize_url
+
+
+class InfoCache:
+    """
+    Short-lived cache of yt-dlp info dicts keyed by normalized URL, so a retry
+    or a fallback path can download straight from an earlier extraction.
+    Format URLs are usually signed and expire, hence the short TTL. Safe to
+    use from yt-dlp worker threads.
+    """
+
+    def __init__(self, ttl_seconds: float = YTDLP_INFO_CACHE_TTL, max_entries: int = YTDLP_INFO_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url: str, variant: str) -> str:
+        return f"{variant}:{normalize_url(url)}"
+
+    def get(self, url: str, variant: str = '') -> Optional[dict]:
+        """A private copy of the cached info dict (yt-dlp mutates what it processes)."""
+        key = self._key(url, variant)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or time.time() - item[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(item[1])
+
+    def put(self, url: str, info: dict, variant: str = ''):
+        with self._lock:
+            self._entries[self._key(url, variant)] = (time.time(), copy.deepcopy(info))
+            self._entries.move_to_end(self._key(url, variant))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, url: str, variant: str = ''):
+        with self._lock:
+            self._entries.pop(self._key(url, variant), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -31,11 +31,11 @@ def main():
     try:
         logger.info("Starting Telegram Download Bot with Health Server...")
         
-        # Start health check server (bind to HEALTH_PORT, not Render PORT)
+        # Health check server (bind to HEALTH_PORT, not Render PORT); it runs on the
+        # bot's event loop and is started by the bot once that loop is running
         from health_server import HealthServer
         health_port = int(os.environ.get('HEALTH_PORT', 10000))
         health_server = HealthServer(port=health_port)
-        health_server.start()
         health_server.update_bot_status("initializing")
         
         # Import after path setup
@@ -46,9 +46,24 @@ def main():
         bot = TelegramDownloadBot()
         logger.info("Bot instance created successfully")
         health_server.update_bot_status("created")
+        bot.health = health_server
+        health_server.add_stats_provider("http_pool", bot.http.stats)
+        health_server.add_stats_provider("delivery_cache", bot.delivery_cache.stats)
+        health_server.add_stats_provider("inflight", bot.inflight.stats)
+        health_server.add_stats_provider("scheduler", bot.scheduler.stats)
+        health_server.add_stats_provider("updates", bot.update_processor.stats)
+        health_server.add_stats_provider("storage", bot.storage.stats)
+        health_server.add_stats_provider("ytdlp_info_cache", bot.ytdlp_info.stats)
+        health_server.add_stats_provider("ytdlp_workers", bot.ytdlp_pool.stats)
+        health_server.add_stats_provider("progress", bot.progress.stats)
+        health_server.add_stats_provider("media", bot.media.stats)
+        if bot.bridge:
+            health_server.add_stats_provider("bridge", bot.bridge.stats)
+        if bot.webhook:
+            health_server.add_stats_provider("webhook", bot.webhook.stats)
         
         # Start the bot
-        logger.info("Starting bot polling...")
+        logger.info("Starting bot (webhook mode)..." if bot.webhook else "Starting bot polling...")
         health_server.update_bot_status("running")
         
         # Use the simplified run method
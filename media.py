@@ -0,0 +1,288 @@
+import os
+import json
+import struct
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+
+from config import MEDIA_WORKERS, MEDIA_PROBE_TIMEOUT, FASTSTART_TIMEOUT, THUMBNAIL_POSITION
+from disk_writer import run_blocking
+
+# Probe results kept for this many files
+PROBE_CACHE_SIZE = 256
+
+EMPTY_INFO = {'width': None, 'height': None, 'duration': None}
+
+# Containers built from ISO BMFF boxes, where moov placement matters
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+# Telegram thumbnail limits: JPEG, at most 320px per side and 200KB
+THUMBNAIL_MAX_SIDE = 320
+THUMBNAIL_MAX_BYTES = 200 * 1024
+
+
+def _file_key(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stat.st_size, int(stat.st_mtime))
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+async def run_tool(*args: str, timeout: float = MEDIA_PROBE_TIMEOUT) -> tuple:
+    """Run ffmpeg/ffprobe as an async subprocess; returns (returncode, stdout, stderr). Killed on timeout."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except BaseException:
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
+
+def top_level_boxes(path: str, limit: int = 64) -> list:
+    """Types of the top-level boxes of an MP4/MOV file, in file order (header reads only)."""
+    boxes = []
+    with open(path, 'rb') as f:
+        size_left = os.fstat(f.fileno()).st_size
+        while size_left >= 8 and len(boxes) < limit:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            size, box_type = struct.unpack('>I4s', header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_size = 16
+            boxes.append(box_type.decode('latin-1'))
+            if size == 0:
+                break  # box runs to the end of the file
+            if size < header_size:
+                break  # corrupt
+            f.seek(size - header_size, os.SEEK_CUR)
+            size_left -= size
+    return boxes
+
+
+def needs_faststart(path: str) -> bool:
+    """True if the moov (index) box comes after mdat, so players must fetch the whole file first."""
+    if not path.lower().endswith(MP4_EXTENSIONS):
+        return False
+    try:
+        boxes = top_level_boxes(path)
+    except (OSError, struct.error):
+        return False
+    if 'moov' not in boxes or 'mdat' not in boxes:
+        return False
+    return boxes.index('mdat') < boxes.index('moov')
+
+
+class MediaTools:
+    """
+    Off-loop media helpers around ffprobe/ffmpeg. At most `workers` tool
+    processes run at once. Video metadata comes from hints (e.g. the yt-dlp
+    info dict) when available, otherwise from a header-only ffprobe, and is
+    cached per file (path, size, mtime).
+    """
+
+    def __init__(self, workers: int = MEDIA_WORKERS):
+        self.workers = workers
+        self._slots = asyncio.Semaphore(workers)
+        self._info: OrderedDict = OrderedDict()
+        self.probes = 0
+        self.cache_hits = 0
+        self.hints_used = 0
+        self.faststart_remuxes = 0
+        self.thumbnails = 0
+
+    def _remember(self, key: tuple, info: dict):
+        self._info[key] = info
+        self._info.move_to_end(key)
+        while len(self._info) > PROBE_CACHE_SIZE:
+            self._info.popitem(last=False)
+
+    def add_hint(self, path: str, width: Optional[int], height: Optional[int], duration: Optional[float]):
+        """Known dimensions of a downloaded file; video_info() will use them instead of probing."""
+        key = _file_key(path)
+        if key and width and height and duration:
+            self._remember(key, {'width': int(width), 'height': int(height), 'duration': int(duration)})
+            self.hints_used += 1
+
+    async def video_info(self, path: str) -> dict:
+        """{'width', 'height', 'duration'} of a video file (values None if unknown)."""
+        key = _file_key(path)
+        if key is None:
+            return dict(EMPTY_INFO)
+        cached = self._info.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return dict(cached)
+        info = await self._probe(path)
+        self._remember(key, info)
+        return dict(info)
+
+    async def _probe(self, path: str) -> dict:
+        self.probes += 1
+        try:
+            async with self._slots:
+                # Header only: first video stream's size plus the container duration
+                returncode, stdout, _ = await run_tool(
+                    'ffprobe', '-v', 'quiet', '-print_format', 'json',
+                    '-probesize', '5M', '-analyzeduration', '0',
+                    '-select_streams', 'v:0',
+                    '-show_entries', 'stream=width,height,duration:format=duration',
+                    path,
+                )
+            if returncode != 0:
+                return dict(EMPTY_INFO)
+            data = json.loads(stdout)
+            stream = (data.get('streams') or [{}])[0]
+            duration = float(stream.get('duration') or data.get('format', {}).get('duration') or 0)
+            return {
+                'width': int(stream['width']) if stream.get('width') else None,
+                'height': int(stream['height']) if stream.get('height') else None,
+                'duration': int(duration) if duration > 0 else None,
+            }
+        except Exception as e:
+            print(f"⚠️ Could not extract video info: {e}")
+            return dict(EMPTY_INFO)
+
+    async def ensure_faststart(self, path: str) -> bool:
+        """
+        Move a trailing moov box to the front (stream copy, no re-encode) so
+        Telegram clients can start playback right away. Returns True if the
+        file was rewritten; already-faststart and non-MP4 files are left alone.
+        """
+        if not await run_blocking(needs_faststart, path):
+            return False
+        old_key = _file_key(path)
+        root, ext = os.path.splitext(path)
+        target = f"{root}.faststart{ext}"
+        try:
+            async with self._slots:
+                returncode, _, stderr = await run_tool(
+                    'ffmpeg', '-y', '-loglevel', 'error', '-i', path,
+                    '-map', '0', '-c', 'copy', '-movflags', '+faststart', target,
+                    timeout=FASTSTART_TIMEOUT,
+                )
+            if returncode != 0:
+                raise Exception(stderr.decode(errors='ignore')[:300])
+            await run_blocking(os.replace, target, path)
+        except Exception as e:
+            print(f"⚠️ Faststart remux failed, sending file as is: {e}")
+            return False
+        finally:
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+        self.faststart_remuxes += 1
+        # Same streams, new file: carry over known metadata
+        cached = self._info.pop(old_key, None) if old_key else None
+        new_key = _file_key(path)
+        if cached and new_key:
+            self._remember(new_key, cached)
+        return True
+
+    async def cut(self, path: str, target: str, start: float, length: float) -> bool:
+        """Stream-copy `length` seconds from `start` (nearest earlier keyframe) into `target`."""
+        movflags = ['-movflags', '+faststart'] if target.lower().endswith(MP4_EXTENSIONS) else []
+        try:
+            async with self._slots:
+                returncode, _, stderr = await run_tool(
+                    'ffmpeg', '-y', '-loglevel', 'error',
+                    '-ss', f'{start:.3f}', '-i', path, '-t', f'{length:.3f}',
+                    '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero',
+                    *movflags, target,
+                    timeout=FASTSTART_TIMEOUT,
+                )
+        except Exception as e:
+            print(f"⚠️ Video cut failed: {e}")
+            return False
+        if returncode != 0:
+            print(f"⚠️ Video cut failed: {stderr.decode(errors='ignore')[:300]}")
+            return False
+        return True
+
+    async def remux_mp4(self, path: str, target: str) -> bool:
+        """Stream-copy the first video and audio stream of `path` into a faststart MP4 (no re-encode)."""
+        try:
+            async with self._slots:
+                returncode, _, stderr = await run_tool(
+                    'ffmpeg', '-y', '-loglevel', 'error', '-i', path,
+                    '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-movflags', '+faststart', target,
+                    timeout=FASTSTART_TIMEOUT,
+                )
+        except Exception as e:
+            print(f"⚠️ MP4 remux failed: {e}")
+            returncode, stderr = None, b''
+        if returncode != 0:
+            if stderr:
+                print(f"⚠️ MP4 remux failed: {stderr.decode(errors='ignore')[:300]}")
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+            return False
+        return True
+
+    def thumbnail_path(self, path: str) -> str:
+        return f"{path}.thumb.jpg"
+
+    async def thumbnail(self, path: str, duration: Optional[float] = None) -> Optional[str]:
+        """
+        JPEG thumbnail of a video within Telegram's limits, from the keyframe
+        nearest THUMBNAIL_POSITION of the way in. Stored next to the file and
+        reused while it is newer than the video; None if ffmpeg cannot make one.
+        """
+        thumb = self.thumbnail_path(path)
+        try:
+            if os.path.getmtime(thumb) >= os.path.getmtime(path):
+                return thumb
+        except OSError:
+            pass
+        if duration is None:
+            duration = (await self.video_info(path))['duration']
+        # Seeking before -i jumps straight to a keyframe instead of decoding up to it
+        offsets = [int(duration * THUMBNAIL_POSITION)] if duration and duration > 1 else []
+        for offset in offsets + [0]:
+            try:
+                async with self._slots:
+                    returncode, _, _ = await run_tool(
+                        'ffmpeg', '-y', '-loglevel', 'error',
+                        '-ss', str(offset), '-i', path,
+                        '-frames:v', '1', '-an', '-sn',
+                        '-vf', f'scale={THUMBNAIL_MAX_SIDE}:{THUMBNAIL_MAX_SIDE}:force_original_aspect_ratio=decrease',
+                        '-q:v', '5', thumb,
+                    )
+            except Exception as e:
+                print(f"⚠️ Thumbnail extraction failed: {e}")
+                return None
+            if returncode == 0 and 0 < _size(thumb) <= THUMBNAIL_MAX_BYTES:
+                self.thumbnails += 1
+                return thumb
+        try:
+            os.unlink(thumb)
+        except FileNotFoundError:
+            pass
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'probes': self.probes,
+            'cache_hits': self.cache_hits,
+            'hints_used': self.hints_used,
+            'faststart_remuxes': self.faststart_remuxes,
+            'thumbnails': self.thumbnails,
+        }
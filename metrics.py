@@ -0,0 +1,132 @@
+import math
+from typing import Callable, Iterable
+
+# Default histogram buckets (seconds): transfers range from sub-second to tens of minutes
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, math.inf)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) if buckets[-1] == math.inf else tuple(buckets) + (math.inf,)
+        # label values -> [bucket counts..., sum, count]
+        self._series: dict = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, series in sorted(self._series.items()):
+            for index, bound in enumerate(self.buckets):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[index]}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """
+    Prometheus text-format metrics: counters and histograms updated by the bot,
+    plus gauges read at scrape time from the stats providers (every numeric
+    field of provider `name` becomes `<prefix>_<name>_<field>`).
+    """
+
+    def __init__(self, prefix: str = 'tgbot'):
+        self.prefix = prefix
+        self._metrics: list = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(f'{self.prefix}_{name}', documentation, tuple(labelnames))
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f'{self.prefix}_{name}', documentation, tuple(labelnames), buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, providers: dict = None, extra_gauges: dict = None) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, value in (extra_gauges or {}).items():
+            lines.append(f'# TYPE {self.prefix}_{name} gauge')
+            lines.append(f'{self.prefix}_{name} {_format_value(value)}')
+        for provider_name, provider in (providers or {}).items():
+            lines.extend(self._provider_lines(provider_name, provider))
+        return '\n'.join(lines) + '\n'
+
+    def _provider_lines(self, provider_name: str, provider: Callable[[], dict]) -> list:
+        try:
+            stats = provider()
+        except Exception:
+            return []
+        lines = []
+        for field, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f'{self.prefix}_{provider_name}_{field}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+        return lines
+
+
+REGISTRY = Registry()
+
+# Time spent per transfer stage: queue (waiting for a slot), download, upload, total
+STAGE_SECONDS = REGISTRY.histogram('stage_seconds', 'Duration of transfer stages in seconds', ('stage',))
+
+# Bytes moved, per direction (download/upload); rate() gives bytes per second
+TRANSFER_BYTES = REGISTRY.counter('transfer_bytes_total', 'Bytes downloaded and uploaded', ('direction',))
+
+# RetryAfter (flood wait) answers from Telegram, per caller
+FLOOD_WAITS = REGISTRY.counter('flood_waits_total', 'Flood-wait (RetryAfter) responses from Telegram', ('source',))
@@ -0,0 +1,158 @@
+import time
+import asyncio
+from typing import Optional
+
+from telegram.error import BadRequest, RetryAfter
+
+from config import PROGRESS_GLOBAL_RATE, PROGRESS_MIN_INTERVAL
+from metrics import FLOOD_WAITS
+
+# After a flood wait, per-message intervals are multiplied by up to this much
+MAX_BACKOFF = 8.0
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+
+class ProgressHandle:
+    """
+    Progress message of one job. report() hands the latest status text to the
+    dispatcher, which edits the message when its turn comes (intermediate texts
+    are dropped). edit_text()/delete() are immediate and drop any pending report,
+    so a stale progress line never overwrites a final status.
+    """
+
+    def __init__(self, dispatcher: 'ProgressDispatcher', target):
+        self.dispatcher = dispatcher
+        self.target = target
+        self.last_text: Optional[str] = None
+        self.last_edit = 0.0
+
+    def report(self, text: str):
+        self.dispatcher.submit(self, text)
+
+    async def edit_text(self, text: str, *args, **kwargs):
+        self.dispatcher.discard(self)
+        result = await self.target.edit_text(text, *args, **kwargs)
+        self.last_text = text
+        self.last_edit = time.monotonic()
+        return result
+
+    async def delete(self, *args, **kwargs):
+        self.dispatcher.discard(self)
+        return await self.target.delete(*args, **kwargs)
+
+
+class ProgressDispatcher:
+    """
+    Single sender for progress edits of all jobs. Keeps the newest text per
+    message, edits only when it changed, spaces edits of one message by at
+    least `min_interval` (longer when many jobs share the `global_rate`
+    edits/second budget) and backs off globally when Telegram answers with
+    RetryAfter.
+    """
+
+    def __init__(self, global_rate: float = PROGRESS_GLOBAL_RATE, min_interval: float = PROGRESS_MIN_INTERVAL):
+        self.global_rate = global_rate
+        self.min_interval = min_interval
+        self.backoff = 1.0
+        self.paused_until = 0.0
+        self.edits = 0
+        self.dropped = 0
+        self.flood_waits = 0
+        self._pending: dict[ProgressHandle, str] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, target) -> ProgressHandle:
+        return ProgressHandle(self, target)
+
+    def submit(self, handle: ProgressHandle, text: str):
+        if handle in self._pending:
+            self.dropped += 1
+        self._pending[handle] = text
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def discard(self, handle: ProgressHandle):
+        self._pending.pop(handle, None)
+
+    def interval(self) -> float:
+        """Current spacing between two edits of the same message."""
+        share = len(self._pending) / self.global_rate if self.global_rate else 0
+        return max(self.min_interval, share) * self.backoff
+
+    def _next_due(self, now: float):
+        """(handle, seconds until due) of the message that waited longest."""
+        interval = self.interval()
+        best = None
+        for handle in self._pending:
+            wait = handle.last_edit + interval - now
+            if best is None or wait < best[1]:
+                best = (handle, wait)
+        return best
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            due = self._next_due(now)
+            if due is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            handle, wait = due
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            text = self._pending.pop(handle)
+            if text != handle.last_text:
+                await self._send(handle, text)
+            # Global budget: never more than global_rate edits per second
+            await asyncio.sleep(1 / self.global_rate if self.global_rate else 0)
+
+    async def _send(self, handle: ProgressHandle, text: str):
+        try:
+            await handle.target.edit_text(text)
+            handle.last_text = text
+            self.edits += 1
+            self.backoff = max(1.0, self.backoff * 0.95)
+        except RetryAfter as e:
+            self.flood_waits += 1
+            FLOOD_WAITS.inc(source='progress')
+            self.paused_until = time.monotonic() + retry_after_seconds(e)
+            self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+            print(f"⏳ Progress edits paused {retry_after_seconds(e):.0f}s (flood wait), backoff x{self.backoff:.1f}")
+            # Retry later unless a newer text arrived meanwhile
+            self._pending.setdefault(handle, text)
+        except BadRequest:
+            handle.last_text = text  # "message is not modified" or the message is gone
+        except Exception:
+            pass
+        handle.last_edit = time.monotonic()
+
+    async def close(self):
+        self._pending.clear()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'edits': self.edits,
+            'dropped': self.dropped,
+            'flood_waits': self.flood_waits,
+            'interval': round(self.interval(), 2),
+            'backoff': round(self.backoff, 2),
+        }
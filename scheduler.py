@@ -0,0 +1,180 @@
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from config import SCHED_MAX_ACTIVE, SCHED_PER_USER, SCHED_FAST_LANE_SLOTS, SCHED_SMALL_FILE_SIZE
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class Job:
+    def __init__(self, seq: int, user_id: int, size_hint: Optional[int], fast: bool,
+                 on_position: Optional[PositionCallback]):
+        self.seq = seq
+        self.user_id = user_id
+        self.size_hint = size_hint
+        self.fast = fast
+        self.on_position = on_position
+        self.position: Optional[int] = None
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def lane(self) -> str:
+        return 'fast' if self.fast else 'bulk'
+
+
+class _Lane:
+    """Waiting jobs of one lane, grouped per user and served round-robin."""
+
+    def __init__(self):
+        self.users: OrderedDict[int, deque] = OrderedDict()
+
+    def add(self, job: Job):
+        self.users.setdefault(job.user_id, deque()).append(job)
+
+    def remove(self, job: Job) -> bool:
+        queue = self.users.get(job.user_id)
+        if not queue or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del self.users[job.user_id]
+        return True
+
+    def pop_next(self, can_run: Callable[[int], bool]) -> Optional[Job]:
+        for user_id in list(self.users):
+            if not can_run(user_id):
+                continue
+            queue = self.users[user_id]
+            job = queue.popleft()
+            if queue:
+                # Served users go to the back of the rotation
+                self.users.move_to_end(user_id)
+            else:
+                del self.users[user_id]
+            return job
+        return None
+
+    def service_order(self) -> list:
+        """Waiting jobs in the order round-robin would serve them (ignoring caps)."""
+        queues = [list(q) for q in self.users.values()]
+        order = []
+        for rank in itertools.count():
+            row = [q[rank] for q in queues if rank < len(q)]
+            if not row:
+                return order
+            order.extend(row)
+
+    def __len__(self):
+        return sum(len(q) for q in self.users.values())
+
+
+class JobScheduler:
+    """
+    Admission control between handle_link and the transfer stages.
+
+    - at most `max_active` jobs run at once, plus `fast_lane_slots` extra
+      slots reserved for small files so they never wait behind huge ones;
+    - each user runs at most `per_user` jobs at once;
+    - waiting users are served round-robin, small files (size hint known and
+      <= `small_file_size`) before everything else.
+    """
+
+    def __init__(self, max_active: int = SCHED_MAX_ACTIVE, per_user: int = SCHED_PER_USER,
+                 fast_lane_slots: int = SCHED_FAST_LANE_SLOTS, small_file_size: int = SCHED_SMALL_FILE_SIZE):
+        self.max_active = max_active
+        self.per_user = per_user
+        self.fast_lane_slots = fast_lane_slots
+        self.small_file_size = small_file_size
+        self.active = 0
+        self.active_per_user: dict[int, int] = {}
+        self._fast = _Lane()
+        self._bulk = _Lane()
+        self._seq = itertools.count()
+        self.completed = 0
+
+    def is_small(self, size_hint: Optional[int]) -> bool:
+        return bool(size_hint) and size_hint <= self.small_file_size
+
+    def _can_run(self, user_id: int) -> bool:
+        return self.active_per_user.get(user_id, 0) < self.per_user
+
+    def _start(self, job: Job):
+        self.active += 1
+        self.active_per_user[job.user_id] = self.active_per_user.get(job.user_id, 0) + 1
+        job.position = 0
+        job.granted.set_result(True)
+
+    def _dispatch(self):
+        while True:
+            job = None
+            if self.active < self.max_active + self.fast_lane_slots:
+                job = self._fast.pop_next(self._can_run)
+            if job is None and self.active < self.max_active:
+                job = self._bulk.pop_next(self._can_run)
+            if job is None:
+                break
+            if job.granted.cancelled():
+                continue  # requester was cancelled before its turn came
+            self._start(job)
+        self._publish_positions()
+
+    def _publish_positions(self):
+        waiting = self._fast.service_order() + self._bulk.service_order()
+        for position, job in enumerate(waiting, start=1):
+            if job.position != position:
+                job.position = position
+                if job.on_position:
+                    asyncio.create_task(self._notify(job, position))
+
+    async def _notify(self, job: Job, position: int):
+        try:
+            await job.on_position(position)
+        except Exception:
+            pass
+
+    def _release(self, job: Job):
+        self.active -= 1
+        self.completed += 1
+        remaining = self.active_per_user.get(job.user_id, 1) - 1
+        if remaining:
+            self.active_per_user[job.user_id] = remaining
+        else:
+            self.active_per_user.pop(job.user_id, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, size_hint: Optional[int] = None,
+                   on_position: Optional[PositionCallback] = None):
+        """Wait for a run slot; `on_position(n)` is called whenever the queue position changes."""
+        job = Job(next(self._seq), user_id, size_hint, self.is_small(size_hint), on_position)
+        (self._fast if job.fast else self._bulk).add(job)
+        self._dispatch()
+        try:
+            await job.granted
+        except BaseException:
+            # Cancelled while waiting: leave the queue (or give back a slot granted meanwhile)
+            still_queued = (self._fast if job.fast else self._bulk).remove(job)
+            if not still_queued and job.granted.done() and not job.granted.cancelled():
+                self._release(job)
+            else:
+                self._publish_positions()
+            raise
+        try:
+            yield job
+        finally:
+            self._release(job)
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'queued_fast': len(self._fast),
+            'queued_bulk': len(self._bulk),
+            'active_users': len(self.active_per_user),
+            'completed': self.completed,
+            'max_active': self.max_active,
+            'per_user': self.per_user,
+            'fast_lane_slots': self.fast_lane_slots,
+        }
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Optional
+
+from delivery_cache import normalize_url
+
+
+class ProgressFanout:
+    """
+    Stands in for a processing message: edit_text()/delete() are mirrored to
+    the leader's message and to every subscriber attached to the same flight.
+    Errors from the leader's message are re-raised, subscribers' are ignored.
+    """
+
+    def __init__(self, leader_msg):
+        self.leader_msg = leader_msg
+        self.subscribers = []
+        self.last_text: Optional[str] = None
+
+    async def attach(self, message):
+        self.subscribers.append(message)
+        if self.last_text:
+            try:
+                await message.edit_text(self.last_text)
+            except Exception:
+                pass
+
+    async def edit_text(self, text: str, *args, **kwargs):
+        self.last_text = text
+        results = await asyncio.gather(
+            self.leader_msg.edit_text(text, *args, **kwargs),
+            *(msg.edit_text(text, *args, **kwargs) for msg in self.subscribers),
+            return_exceptions=True,
+        )
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        return results[0]
+
+    async def delete(self, *args, **kwargs):
+        results = await asyncio.gather(
+            self.leader_msg.delete(*args, **kwargs),
+            *(msg.delete(*args, **kwargs) for msg in self.subscribers),
+            return_exceptions=True,
+        )
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        return results[0]
+
+
+class Flight:
+    """One in-progress resolve/download/upload that later requests can wait on."""
+
+    def __init__(self, key: str, leader_msg):
+        self.key = key
+        self.progress = ProgressFanout(leader_msg)
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self.progress.subscribers)
+
+    async def wait(self) -> Optional[dict]:
+        """
+        Delivery record of the leader's upload, or None when the leader's handler
+        already explained the outcome on the shared progress message.
+        Raises the leader's error if it failed.
+        """
+        return await asyncio.shield(self.result)
+
+
+class InflightRequests:
+    """Single-flight registry: at most one transfer per normalized URL at a time."""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self.coalesced = 0
+
+    def get(self, url: str) -> Optional[Flight]:
+        return self._flights.get(normalize_url(url))
+
+    def start(self, url: str, leader_msg) -> Flight:
+        flight = Flight(normalize_url(url), leader_msg)
+        self._flights[flight.key] = flight
+        return flight
+
+    async def join(self, flight: Flight, message):
+        self.coalesced += 1
+        await flight.progress.attach(message)
+
+    def finish(self, flight: Flight, delivery: Optional[dict] = None, error: Optional[BaseException] = None):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.result.done():
+            return
+        if error is not None:
+            flight.result.set_exception(error)
+            # Mark retrieved so a flight without subscribers does not log "exception never retrieved"
+            flight.result.exception()
+        else:
+            flight.result.set_result(delivery)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._flights),
+            'subscribers': sum(f.subscriber_count for f in self._flights.values()),
+            'coalesced_total': self.coalesced,
+        }
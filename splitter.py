@@ -0,0 +1,131 @@
+import os
+import math
+import asyncio
+from typing import AsyncIterator, Optional
+
+from disk_writer import run_blocking
+from media import MediaTools
+
+# Parts are planned this far below the limit (container overhead, bitrate swings)
+SPLIT_MARGIN = 0.95
+
+# Attempts at re-cutting a video part that came out over the limit
+RECUT_ATTEMPTS = 3
+
+COPY_CHUNK = 4 * 1024 * 1024
+
+
+class Part:
+    def __init__(self, index: int, count: Optional[int], path: str, filename: str, size: int):
+        self.index = index
+        # None when the number of parts is only known at the end (video splits)
+        self.count = count
+        self.path = path
+        self.filename = filename
+        self.size = size
+
+    def __repr__(self):
+        return f"Part({self.index}/{self.count or '?'}, {self.filename}, {self.size})"
+
+
+def copy_range(source: str, target: str, offset: int, length: int):
+    """Copy `length` bytes of `source` starting at `offset` into a new file (blocking)."""
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        src.seek(offset)
+        left = length
+        while left > 0:
+            chunk = src.read(min(COPY_CHUNK, left))
+            if not chunk:
+                break
+            dst.write(chunk)
+            left -= len(chunk)
+
+
+async def byte_parts(path: str, filename: str, part_size: int, out_dir: str) -> AsyncIterator[Part]:
+    """Raw byte split into `<filename>.001`, `.002`, ... (rejoin with cat)."""
+    total = os.path.getsize(path)
+    count = math.ceil(total / part_size)
+    for index in range(1, count + 1):
+        offset = (index - 1) * part_size
+        length = min(part_size, total - offset)
+        name = f"{filename}.{index:03d}"
+        target = os.path.join(out_dir, name)
+        await run_blocking(copy_range, path, target, offset, length)
+        yield Part(index, count, target, name, length)
+
+
+async def video_parts(tools: MediaTools, path: str, filename: str, duration: float, size: int,
+                      part_size: int, out_dir: str) -> AsyncIterator[Part]:
+    """
+    Time-based split by stream copy into playable `<name>.partNN<ext>` files.
+    Part length follows the average bitrate; a part that still comes out over
+    `part_size` is cut again shorter.
+    """
+    stem, ext = os.path.splitext(filename)
+    planned = duration * part_size / size * SPLIT_MARGIN
+    start = 0.0
+    index = 1
+    # Stop short of the end so rounding never leaves an empty last part
+    while start < duration - 0.5:
+        name = f"{stem}.part{index:02d}{ext}"
+        target = os.path.join(out_dir, name)
+        length = min(planned, duration - start + 1)
+        for _ in range(RECUT_ATTEMPTS):
+            if not await tools.cut(path, target, start, length):
+                raise Exception(f"ffmpeg could not cut part {index}")
+            part_bytes = os.path.getsize(target)
+            if part_bytes <= part_size:
+                break
+            length *= part_size / part_bytes * SPLIT_MARGIN
+        else:
+            raise Exception(f"part {index} stays over the size limit")
+        yield Part(index, None, target, name, part_bytes)
+        start += length
+        index += 1
+
+
+async def read_ahead(parts: AsyncIterator[Part], depth: int = 1) -> AsyncIterator[Part]:
+    """
+    Produce up to `depth` parts ahead of the consumer in a background task, so
+    cutting the next part overlaps uploading the current one. A slot is freed
+    when the consumer asks for the next part (it must be done with the previous
+    one by then), so at most depth + 1 part files exist at once.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(depth + 1)
+    done = object()
+
+    async def pump():
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    part = await parts.__anext__()
+                except StopAsyncIteration:
+                    break
+                queue.put_nowait(part)
+            queue.put_nowait(done)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            slots.release()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await parts.aclose()
+
+
+def remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
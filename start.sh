@@ -21,14 +21,35 @@ if [ "$HEALTH_PORT" = "$PORT" ]; then
   echo "HEALTH_PORT ($HEALTH_PORT) equals PORT ($PORT). Using $NEW_HEALTH for health server instead."
   HEALTH_PORT="$NEW_HEALTH"
 fi
+# Webhook receiver inside the bot process; keep it off the other two ports
+WEBHOOK_PORT="${WEBHOOK_PORT:-8443}"
+while [ "$WEBHOOK_PORT" = "$PORT" ] || [ "$WEBHOOK_PORT" = "$HEALTH_PORT" ]; do
+  WEBHOOK_PORT=$((WEBHOOK_PORT + 1))
+done
+export WEBHOOK_PORT
+
+# Local mode: the bot hands the server file paths instead of uploading bytes.
+# Only when the bot talks to this server (BOT_API_BASE_URL not pointing elsewhere).
+BOT_API_DIR="${BOT_API_DIR:-/var/lib/telegram-bot-api}"
+if [[ -z "${BOT_API_BASE_URL:-}" ]]; then
+  BOT_API_LOCAL_MODE="${BOT_API_LOCAL_MODE:-true}"
+else
+  BOT_API_LOCAL_MODE="${BOT_API_LOCAL_MODE:-false}"
+fi
+LOCAL_FLAGS=()
+if [[ "${BOT_API_LOCAL_MODE}" == "true" ]]; then
+  LOCAL_FLAGS+=(--local)
+fi
+export BOT_API_DIR BOT_API_LOCAL_MODE
 
 # Start Telegram Bot API server (listens on Render PORT)
 telegram-bot-api \
   --api-id="${TELEGRAM_API_ID}" \
   --api-hash="${TELEGRAM_API_HASH}" \
   --http-port="${PORT}" \
-  --dir=/var/lib/telegram-bot-api \
-  --temp-dir=/tmp/telegram-bot-api &
+  --dir="${BOT_API_DIR}" \
+  --temp-dir=/tmp/telegram-bot-api \
+  ${LOCAL_FLAGS[@]+"${LOCAL_FLAGS[@]}"} &
 
 # Wait for the Bot API server to become ready (max ~60s)
 echo "Waiting for Bot API server on 127.0.0.1:${PORT}..."
@@ -53,5 +74,11 @@ done
 export BOT_API_BASE_URL="${BOT_API_BASE_URL:-http://127.0.0.1:${PORT}/bot}"
 export BOT_API_BASE_FILE_URL="${BOT_API_BASE_FILE_URL:-http://127.0.0.1:${PORT}/file/bot}"
 
+# WEBHOOK_MODE=true with our local server in local mode: it delivers updates to the
+# bot over loopback HTTP (allowed for --local servers), no public URL needed
+if [[ "${WEBHOOK_MODE:-false}" == "true" && -z "${WEBHOOK_URL:-}" && "${BOT_API_LOCAL_MODE}" == "true" ]]; then
+  export WEBHOOK_URL="http://127.0.0.1:${WEBHOOK_PORT}"
+fi
+
 # Launch the Python bot (health server will bind to HEALTH_PORT)
 exec python3 main.py
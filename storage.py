@@ -0,0 +1,343 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import hashlib
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Iterable, Optional
+
+from config import STORAGE_ROOT, STORAGE_QUOTA, STORAGE_MIN_FREE, STORAGE_WAIT_SECONDS
+from disk_writer import run_blocking
+
+# Journaled partial downloads live here so they survive their job (for resume)
+PARTIAL_DIR = 'partial'
+
+# yt-dlp's .part and fragment files, one directory per URL (continued on retry or after a restart)
+YTDLP_PARTIAL_DIR = os.path.join(PARTIAL_DIR, 'ytdlp')
+
+# Hard links that give a file its upload name for the local Bot API server
+HANDOFF_DIR = 'handoff'
+
+# Storage of the job running in the current task (set by StorageManager.job)
+_current_job: contextvars.ContextVar = contextvars.ContextVar('storage_job', default=None)
+
+
+class StorageFull(Exception):
+    pass
+
+
+def _allocated(st: os.stat_result) -> int:
+    # Blocks actually on disk: preallocated (sparse) segmented downloads only count what was written
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def disk_usage(paths: Iterable[str]) -> int:
+    """
+    Bytes on disk under `paths` (files or directory trees), counting every
+    inode once so hard links (hand-off names) are not counted twice. Blocking.
+    """
+    seen = set()
+    total = 0
+
+    def add(path):
+        nonlocal total
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if (st.st_dev, st.st_ino) not in seen:
+            seen.add((st.st_dev, st.st_ino))
+            total += _allocated(st)
+
+    for path in paths:
+        if not os.path.isdir(path):
+            add(path)
+            continue
+        for root, _dirs, files in os.walk(path):
+            for name in files:
+                add(os.path.join(root, name))
+    return total
+
+
+class JobStorage:
+    """Working directory and disk reservation of one job."""
+
+    def __init__(self, manager: 'StorageManager', job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.dir = os.path.join(manager.root, job_id)
+        self.reserved = 0
+        # Files outside the job dir written for this job: counted against its reservation
+        self.tracked: list = []
+        # Files outside the job dir deleted with the job (also counted)
+        self.adopted: list = []
+        os.makedirs(self.dir, exist_ok=True)
+
+    async def reserve(self, nbytes: Optional[int], on_wait: Optional[Callable[[], Awaitable[None]]] = None):
+        """Grow this job's reservation to `nbytes`; waits for space or raises StorageFull."""
+        if nbytes and nbytes > self.reserved:
+            await self.manager._grow(self, nbytes, on_wait)
+
+    def reserve_blocking(self, nbytes: Optional[int], loop: asyncio.AbstractEventLoop):
+        """reserve() for code running in a worker thread."""
+        asyncio.run_coroutine_threadsafe(self.reserve(nbytes), loop).result()
+
+    def track(self, path: str):
+        """Count `path` (a file outside the job dir, e.g. a resumable partial) as written by this job."""
+        self.tracked.append(path)
+
+    def adopt(self, path: str):
+        """Delete `path` (a file outside the job dir) together with the job."""
+        self.adopted.append(path)
+
+    def usage(self) -> int:
+        """Bytes this job has on disk (blocking)."""
+        return disk_usage([self.dir, *self.tracked, *self.adopted])
+
+    def cleanup(self):
+        """Remove the job dir and adopted paths (blocking; StorageManager.job runs it on the disk threads)."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        for path in self.adopted:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️ Could not remove {path}: {e}")
+
+
+class StorageManager:
+    """
+    Managed temp area for downloads. Every job gets its own directory under
+    `root`, reserves disk space for what it is about to download and is
+    removed in full when it ends, successfully or not. Reservations wait
+    while the quota or the free disk space cannot hold them, and are rejected
+    outright if they could never fit.
+    """
+
+    def __init__(self, root: str = STORAGE_ROOT, quota: int = STORAGE_QUOTA,
+                 min_free: int = STORAGE_MIN_FREE, wait_seconds: float = STORAGE_WAIT_SECONDS):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self.wait_seconds = wait_seconds
+        self.jobs: dict[str, JobStorage] = {}
+        self.rejected = 0
+        self._cond = asyncio.Condition()
+        os.makedirs(os.path.join(self.root, PARTIAL_DIR), exist_ok=True)
+
+    @property
+    def reserved(self) -> int:
+        return sum(job.reserved for job in self.jobs.values())
+
+    def partial_path(self, url: str, filename: str) -> str:
+        """Location for a journaled (resumable) download of `url`."""
+        directory = os.path.join(self.root, PARTIAL_DIR, _url_key(url))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def ytdlp_partial_dir(self, url: str) -> str:
+        """Directory for yt-dlp's intermediate files of `url`, outside any job so they survive it."""
+        directory = os.path.join(self.root, YTDLP_PARTIAL_DIR, _url_key(url))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def expire_ytdlp_partials(self, max_age: float) -> list:
+        """Delete yt-dlp partial directories untouched for `max_age` seconds; returns the ones kept."""
+        base = os.path.join(self.root, YTDLP_PARTIAL_DIR)
+        if not os.path.isdir(base):
+            return []
+        cutoff = time.time() - max_age
+        kept = []
+        for entry in os.scandir(base):
+            if not entry.is_dir():
+                continue
+            mtimes = [entry.stat().st_mtime]
+            for root, _dirs, files in os.walk(entry.path):
+                for name in files:
+                    try:
+                        mtimes.append(os.path.getmtime(os.path.join(root, name)))
+                    except OSError:
+                        pass
+            if max(mtimes) < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                kept.append(entry.path)
+        return kept
+
+    def sweep(self, keep: Iterable[str] = ()) -> int:
+        """Remove orphaned files left by earlier runs, except the paths (files or whole directories) in `keep`."""
+        keep = {os.path.abspath(path) for path in keep}
+        kept_dirs = tuple(path + os.sep for path in keep if os.path.isdir(path))
+        removed = 0
+        for root, dirs, files in os.walk(self.root, topdown=False):
+            for name in files:
+                path = os.path.abspath(os.path.join(root, name))
+                if path in keep or path.startswith(kept_dirs):
+                    continue
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except OSError:
+                    pass
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass  # not empty: holds a kept file
+        os.makedirs(os.path.join(self.root, PARTIAL_DIR), exist_ok=True)
+        if removed:
+            print(f"🗑️ Swept {removed} orphaned file(s) from {self.root}")
+        return removed
+
+    def _measure(self) -> tuple:
+        """Free disk space and the bytes each job has written so far (blocking)."""
+        usage = {job_id: job.usage() for job_id, job in list(self.jobs.items())}
+        return shutil.disk_usage(self.root).free, usage
+
+    def _outstanding(self, usage: dict) -> int:
+        """Reserved bytes not yet written to disk."""
+        return sum(max(0, job.reserved - usage.get(job_id, 0)) for job_id, job in self.jobs.items())
+
+    def _fits(self, extra: int, free: int, usage: dict) -> bool:
+        if self.reserved + extra > self.quota:
+            return False
+        return extra <= free - self.min_free - self._outstanding(usage)
+
+    def _could_ever_fit(self, job: JobStorage, nbytes: int, free: int, usage: dict) -> bool:
+        if nbytes > self.quota:
+            return False
+        # Space other jobs would give back when they finish
+        others = sum(used for job_id, used in usage.items() if job_id != job.job_id)
+        return nbytes - usage.get(job.job_id, 0) <= free + others - self.min_free
+
+    async def _grow(self, job: JobStorage, nbytes: int, on_wait):
+        # Walking the job files is disk I/O: measure on the disk threads, never on the loop
+        free, usage = await run_blocking(self._measure)
+        if not self._could_ever_fit(job, nbytes, free, usage):
+            self.rejected += 1
+            raise StorageFull(f"فضای کافی روی دیسک برای این فایل وجود ندارد ({nbytes // (1024 * 1024)}MB)")
+        async with self._cond:
+            free, usage = await run_blocking(self._measure)
+            if not self._fits(nbytes - job.reserved, free, usage):
+                print(f"💾 Job {job.job_id} waiting for {nbytes // (1024 * 1024)}MB of disk space")
+                if on_wait:
+                    try:
+                        await on_wait()
+                    except Exception:
+                        pass
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.wait_seconds
+                while not self._fits(nbytes - job.reserved, free, usage):
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        self.rejected += 1
+                        raise StorageFull("فضای دیسک در حال حاضر پر است. لطفاً بعداً دوباره تلاش کنید.")
+                    free, usage = await run_blocking(self._measure)
+            job.reserved = nbytes
+
+    @asynccontextmanager
+    async def job(self, job_id: str):
+        """Working area of one job, removed (with its reservation) when the block exits."""
+        job = JobStorage(self, job_id)
+        self.jobs[job_id] = job
+        token = _current_job.set(job)
+        try:
+            yield job
+        finally:
+            _current_job.reset(token)
+            del self.jobs[job_id]
+            await run_blocking(job.cleanup)
+            async with self._cond:
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        usage = shutil.disk_usage(self.root)
+        return {
+            'root': self.root,
+            'jobs': len(self.jobs),
+            'reserved_bytes': self.reserved,
+            'quota_bytes': self.quota,
+            'disk_free_bytes': usage.free,
+            'rejected': self.rejected,
+        }
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+
+def current_job() -> Optional[JobStorage]:
+    return _current_job.get()
+
+
+def work_dir() -> str:
+    """Directory the current job should write into (system temp dir outside a job)."""
+    job = _current_job.get()
+    if job is not None:
+        return job.dir
+    return tempfile.gettempdir()
+
+
+def new_job_id(*parts) -> str:
+    return '-'.join(str(part) for part in parts + (int(time.time() * 1000),))
+
+
+def handoff_path(path: str, filename: str) -> str:
+    """
+    Absolute path the local Bot API server should read so the sent file is
+    named `filename`: the file itself, or a hard link to it in the job dir
+    (same disk, no copy). Blocking; call via disk_writer.run_blocking.
+    """
+    path = os.path.abspath(path)
+    filename = filename.replace(os.sep, '_')
+    job = current_job()
+    if os.path.basename(path) == filename or job is None:
+        return path
+    directory = os.path.join(job.dir, HANDOFF_DIR)
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, filename)
+    try:
+        if os.path.lexists(target):
+            os.unlink(target)
+        os.link(path, target)
+    except OSError:
+        return path
+    return target
+
+
+def sweep_server_files(root: str, max_age: float) -> tuple:
+    """
+    Delete files older than `max_age` seconds that a local telegram-bot-api
+    server keeps under its --dir (<dir>/<bot>/<kind>/...). Files directly in a
+    bot's directory are its database and are never touched. Returns (files, bytes).
+    """
+    cutoff = time.time() - max_age
+    removed = freed = 0
+    if not os.path.isdir(root):
+        return 0, 0
+    for bot_dir in os.scandir(root):
+        if not bot_dir.is_dir():
+            continue
+        for kind in os.scandir(bot_dir.path):
+            if not kind.is_dir():
+                continue
+            for dirpath, _dirs, files in os.walk(kind.path):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                        if stat.st_mtime < cutoff:
+                            os.unlink(path)
+                            removed += 1
+                            freed += stat.st_size
+                    except OSError:
+                        pass
+    return removed, freed
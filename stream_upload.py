@@ -0,0 +1,262 @@
+import json
+import uuid
+import asyncio
+import mimetypes
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+import aiohttp
+
+from config import BOT_TOKEN, BOT_API_BASE_URL
+from disk_writer import run_blocking
+from metrics import FLOOD_WAITS
+
+# Bot API endpoint used when no local server is configured
+DEFAULT_BOT_API_BASE_URL = "https://api.telegram.org/bot"
+
+# Bytes read from disk per step of a file upload (the only part of the file in memory)
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+class ByteRingBuffer:
+    """
+    Bounded async byte buffer between one producer (download) and one consumer
+    (upload). write() waits while the buffer is full, read() waits while it is
+    empty, so memory stays at `capacity` no matter how large the file is.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._chunks: deque = deque()
+        self._size = 0
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._cancelled = False
+        self._cond = asyncio.Condition()
+
+    async def write(self, data: bytes):
+        async with self._cond:
+            # A single chunk larger than the buffer is allowed once the buffer is empty
+            await self._cond.wait_for(
+                lambda: self._cancelled or self._size == 0 or self._size + len(data) <= self.capacity
+            )
+            if self._cancelled:
+                raise Exception("upload side stopped reading")
+            self._chunks.append(data)
+            self._size += len(data)
+            self._cond.notify_all()
+
+    async def read(self, max_bytes: int) -> bytes:
+        """Return up to `max_bytes`; b'' means the producer finished."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._chunks or self._eof or self._error)
+            if self._error is not None:
+                raise self._error
+            if not self._chunks:
+                return b''
+            chunk = self._chunks.popleft()
+            if len(chunk) > max_bytes:
+                self._chunks.appendleft(chunk[max_bytes:])
+                chunk = chunk[:max_bytes]
+            self._size -= len(chunk)
+            self._cond.notify_all()
+            return chunk
+
+    async def close(self):
+        async with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    async def fail(self, error: BaseException):
+        async with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    async def cancel(self):
+        async with self._cond:
+            self._cancelled = True
+            self._chunks.clear()
+            self._size = 0
+            self._cond.notify_all()
+
+
+class MultipartBody:
+    """
+    multipart/form-data body produced on the fly: plain fields first, then small
+    in-memory attachments (e.g. a thumbnail, as (field, filename, data) tuples),
+    then one file part whose bytes come from an async iterator. The total length
+    is known up front, so the request is sent with a Content-Length instead of
+    chunked.
+    """
+
+    def __init__(self, fields: dict, file_field: str, filename: str, file_size: int,
+                 source: AsyncIterator[bytes], content_type: Optional[str] = None,
+                 attachments: Optional[list] = None):
+        self.boundary = uuid.uuid4().hex
+        self.file_size = file_size
+        self.source = source
+        self.bytes_sent = 0
+        head = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            head.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        head = [''.join(head).encode('utf-8')]
+        for name, attachment_name, data in attachments or ():
+            head.append(self._part_header(name, attachment_name))
+            head.append(data + b'\r\n')
+        head.append(self._part_header(file_field, filename, content_type))
+        self.head = b''.join(head)
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    def _part_header(self, name: str, filename: str, content_type: Optional[str] = None) -> bytes:
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        safe_name = filename.replace('"', '_').replace('\r', '').replace('\n', '')
+        return (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"; filename="{safe_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    @property
+    def content_length(self) -> int:
+        return len(self.head) + self.file_size + len(self.tail)
+
+    async def iter_body(self):
+        yield self.head
+        async for chunk in self.source:
+            self.bytes_sent += len(chunk)
+            if self.bytes_sent > self.file_size:
+                raise Exception(f"source produced more than the announced {self.file_size} bytes")
+            yield chunk
+        if self.bytes_sent != self.file_size:
+            raise Exception(f"source ended after {self.bytes_sent} of {self.file_size} bytes")
+        yield self.tail
+
+
+async def iter_ring_buffer(buffer: ByteRingBuffer, chunk_size: int = 256 * 1024):
+    while True:
+        chunk = await buffer.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def iter_file(path: str, chunk_size: int = FILE_CHUNK_SIZE,
+                    on_progress: Optional[Callable[[int], None]] = None):
+    """Chunks of a file read on the disk threads; `on_progress(bytes_read)` after each."""
+    with open(path, 'rb') as f:
+        position = 0
+        while True:
+            chunk = await run_blocking(f.read, chunk_size)
+            if not chunk:
+                return
+            position += len(chunk)
+            if on_progress:
+                on_progress(position)
+            yield chunk
+
+
+class BotApiError(Exception):
+    def __init__(self, status: int, description: str, retry_after: Optional[int] = None):
+        super().__init__(f"Bot API error {status}: {description}")
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+async def send_multipart(session: aiohttp.ClientSession, method: str, body: MultipartBody) -> dict:
+    """POST a streamed multipart body to a Bot API method and return its `result` object."""
+    base_url = BOT_API_BASE_URL or DEFAULT_BOT_API_BASE_URL
+    url = f"{base_url}{BOT_TOKEN}/{method}"
+    headers = {
+        'Content-Type': body.content_type,
+        'Content-Length': str(body.content_length),
+    }
+    async with session.post(url, data=body.iter_body(), headers=headers) as response:
+        try:
+            payload = await response.json(content_type=None)
+        except Exception:
+            raise BotApiError(response.status, (await response.text())[:200])
+    if not payload.get('ok'):
+        params = payload.get('parameters') or {}
+        if params.get('retry_after'):
+            FLOOD_WAITS.inc(source='upload')
+        raise BotApiError(
+            payload.get('error_code', response.status),
+            payload.get('description', 'unknown error'),
+            params.get('retry_after'),
+        )
+    return payload['result']
+
+
+async def pipe_to_upload(
+    session: aiohttp.ClientSession,
+    method: str,
+    fields: dict,
+    file_field: str,
+    filename: str,
+    file_size: int,
+    produce: Callable[[ByteRingBuffer], asyncio.Future],
+    buffer_size: int,
+) -> dict:
+    """
+    Run `produce(buffer)` (which writes the file's bytes into the ring buffer)
+    concurrently with a streamed upload that drains it. Either side failing
+    stops the other.
+    """
+    buffer = ByteRingBuffer(buffer_size)
+
+    async def producer():
+        try:
+            await produce(buffer)
+            await buffer.close()
+        except BaseException as e:
+            await buffer.fail(e if isinstance(e, Exception) else Exception("download cancelled"))
+            raise
+
+    body = MultipartBody(fields, file_field, filename, file_size, iter_ring_buffer(buffer))
+    producer_task = asyncio.create_task(producer())
+    try:
+        result = await send_multipart(session, method, body)
+    except BaseException as e:
+        await buffer.cancel()
+        producer_task.cancel()
+        (produce_result,) = await asyncio.gather(producer_task, return_exceptions=True)
+        # Prefer the download-side error over the aborted request it caused
+        if isinstance(produce_result, Exception):
+            raise produce_result from e
+        raise
+    await producer_task
+    return result
+
+
+async def upload_file(
+    session: aiohttp.ClientSession,
+    method: str,
+    fields: dict,
+    file_field: str,
+    path: str,
+    filename: str,
+    file_size: int,
+    attachments: Optional[list] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """
+    Send a file from disk to a Bot API method as a streamed multipart body.
+    Only one chunk of the file is in memory at a time, whatever its size;
+    `on_progress(bytes_sent)` follows the body as aiohttp consumes it.
+    """
+    source = iter_file(path, on_progress=on_progress)
+    body = MultipartBody(fields, file_field, filename, file_size, source, attachments=attachments)
+    return await send_multipart(session, method, body)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# config.py exits without a token; tests never talk to Telegram
+os.environ.setdefault('BOT_TOKEN', '123456:test-token')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
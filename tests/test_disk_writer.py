@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+from disk_writer import WriteBehindFile  # noqa: E402
+
+
+def test_appends_are_written_in_order_and_flushed_on_close(tmp_path):
+    path = tmp_path / 'out.bin'
+    chunks = [bytes([index]) * 1000 for index in range(50)]
+
+    async def run():
+        async with WriteBehindFile(str(path), max_chunks=2) as writer:
+            for chunk in chunks:
+                await writer.write(chunk)
+        return writer.bytes_written
+
+    assert asyncio.run(run()) == 50 * 1000
+    assert path.read_bytes() == b''.join(chunks)
+
+
+def test_offset_writes_fill_a_preallocated_file(tmp_path):
+    path = tmp_path / 'out.bin'
+    written = []
+
+    async def run():
+        writer = await WriteBehindFile(str(path), size=30).open()
+        # Segments arrive out of order; on_written runs once their bytes are on disk
+        await writer.write(b'c' * 10, 20, lambda offset, length: written.append((offset, length)))
+        await writer.write(b'a' * 10, 0, lambda offset, length: written.append((offset, length)))
+        await writer.close()
+
+    asyncio.run(run())
+    assert path.read_bytes() == b'a' * 10 + b'\0' * 10 + b'c' * 10
+    assert written == [(20, 10), (0, 10)]
+
+
+def test_reopening_without_truncate_keeps_data(tmp_path):
+    path = tmp_path / 'out.bin'
+    path.write_bytes(b'x' * 20)
+
+    async def run():
+        writer = await WriteBehindFile(str(path), size=20, truncate=False).open()
+        await writer.write(b'y' * 10, 10)
+        await writer.close()
+
+    asyncio.run(run())
+    assert path.read_bytes() == b'x' * 10 + b'y' * 10
+
+
+def test_write_error_reaches_the_producer(tmp_path):
+    path = tmp_path / 'out.bin'
+
+    def fail(offset, length):
+        raise OSError('disk full')
+
+    async def run():
+        writer = await WriteBehindFile(str(path)).open()
+        await writer.write(b'a' * 10, None, fail)
+        # Let the writer task apply the failing chunk
+        for _ in range(100):
+            if writer._error is not None:
+                break
+            await asyncio.sleep(0.01)
+        with pytest.raises(Exception, match='disk full'):
+            await writer.write(b'b' * 10)
+        with pytest.raises(Exception, match='disk full'):
+            await writer.close()
+        # abort() after a failure closes quietly
+        await writer.abort()
+        assert writer.fd is None
+
+    asyncio.run(run())
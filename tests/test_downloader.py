@@ -0,0 +1,130 @@
+import asyncio
+import re
+
+import pytest
+
+pytest.importorskip('dotenv')
+pytest.importorskip('aiohttp')
+
+import downloader  # noqa: E402
+from download_journal import DownloadJournal  # noqa: E402
+
+URL = 'https://example.com/file.bin'
+DATA = bytes(range(256)) * 1024  # 256KB
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.content = FakeContent(body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Serves DATA, honouring Range and If-Range like an HTTP server with ETag `etag`."""
+
+    def __init__(self, data: bytes = DATA, etag: str = '"v1"'):
+        self.data = data
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, allow_redirects=True):
+        headers = dict(headers or {})
+        self.requests.append(headers)
+        if_range = headers.get('If-Range')
+        match = re.match(r'bytes=(\d+)-(\d*)', headers.get('Range', ''))
+        if not match or (if_range and if_range != self.etag):
+            return FakeResponse(200, self.data)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(self.data) - 1
+        return FakeResponse(206, self.data[start:end + 1])
+
+
+def new_entry(journal, path, etag='"v1"'):
+    return journal.resume_or_start(URL, str(path), len(DATA), etag, None)
+
+
+def test_fresh_download_fetches_every_range(tmp_path):
+    journal = DownloadJournal(str(tmp_path / 'journal'))
+    path = tmp_path / 'file.bin'
+    entry = new_entry(journal, path)
+    session = FakeSession()
+
+    downloaded = asyncio.run(downloader.download_segmented(
+        session, URL, str(path), len(DATA), segments=4, journal=journal, entry=entry
+    ))
+
+    assert downloaded == len(DATA)
+    assert path.read_bytes() == DATA
+    assert len(session.requests) == 4
+    assert entry.completed == [[0, len(DATA) - 1]]
+
+
+def test_resume_requests_only_missing_bytes_with_if_range(tmp_path):
+    journal = DownloadJournal(str(tmp_path / 'journal'))
+    path = tmp_path / 'file.bin'
+    half = len(DATA) // 2
+    # An earlier run wrote and journaled the first half
+    path.write_bytes(DATA[:half] + b'\0' * (len(DATA) - half))
+    entry = new_entry(journal, path)
+    journal.record(entry, 0, half - 1)
+    session = FakeSession()
+    progress = []
+
+    async def on_progress(done, total):
+        progress.append(done)
+
+    asyncio.run(downloader.download_segmented(
+        session, URL, str(path), len(DATA), segments=1, on_progress=on_progress,
+        journal=journal, entry=entry
+    ))
+
+    assert path.read_bytes() == DATA
+    assert session.requests == [{'Range': f'bytes={half}-{len(DATA) - 1}', 'If-Range': '"v1"'}]
+    # Progress continues from the bytes already on disk
+    assert progress[-1] == len(DATA)
+    assert entry.completed == [[0, len(DATA) - 1]]
+
+
+def test_changed_remote_file_raises(tmp_path):
+    journal = DownloadJournal(str(tmp_path / 'journal'))
+    path = tmp_path / 'file.bin'
+    half = len(DATA) // 2
+    path.write_bytes(DATA[:half] + b'\0' * (len(DATA) - half))
+    entry = new_entry(journal, path)
+    journal.record(entry, 0, half - 1)
+    # The server now has another version: If-Range fails and it answers 200
+    session = FakeSession(etag='"v2"')
+
+    with pytest.raises(downloader.RemoteFileChanged):
+        asyncio.run(downloader.download_segmented(
+            session, URL, str(path), len(DATA), segments=1, journal=journal, entry=entry
+        ))
+    # Bytes from the other version were not written or journaled
+    assert path.read_bytes()[:half] == DATA[:half]
+    assert entry.completed == [[0, half - 1]]
+
+
+def test_plan_ranges_covers_missing_bytes_only():
+    chunk = downloader.CHUNK_SIZE
+    missing = [[0, 4 * chunk - 1], [10 * chunk, 10 * chunk + 99]]
+
+    ranges = downloader.plan_ranges(missing, 3)
+
+    assert len(ranges) == 3
+    assert sum(end - start + 1 for start, end in ranges) == 4 * chunk + 100
+    assert ranges[-1] == (10 * chunk, 10 * chunk + 99)
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('dotenv')
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter  # noqa: E402
+
+from progress import ProgressDispatcher  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, fail_with=None):
+        self.edits = []
+        self.fail_with = fail_with
+
+    async def edit_text(self, text, *args, **kwargs):
+        if self.fail_with:
+            error, self.fail_with = self.fail_with, None
+            raise error
+        self.edits.append(text)
+
+
+def test_submit_keeps_only_the_newest_text():
+    dispatcher = ProgressDispatcher(global_rate=100, min_interval=0)
+    message = FakeMessage()
+
+    async def run():
+        handle = dispatcher.track(message)
+        for text in ('10%', '20%', '30%'):
+            handle.report(text)
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+
+    asyncio.run(run())
+    assert message.edits == ['30%']
+    assert dispatcher.dropped == 2
+    assert dispatcher.edits == 1
+
+
+def test_submit_skips_unchanged_text_and_restarts_the_sender():
+    dispatcher = ProgressDispatcher(global_rate=100, min_interval=0)
+    message = FakeMessage()
+
+    async def run():
+        handle = dispatcher.track(message)
+        handle.report('50%')
+        await asyncio.sleep(0.05)
+        handle.report('50%')
+        await asyncio.sleep(0.05)
+        # A sender that ended (or failed) is replaced on the next submit
+        dispatcher._task.cancel()
+        await asyncio.sleep(0)
+        handle.report('60%')
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+
+    asyncio.run(run())
+    assert message.edits == ['50%', '60%']
+
+
+def test_submit_spaces_edits_of_one_message():
+    dispatcher = ProgressDispatcher(global_rate=100, min_interval=0.2)
+    message = FakeMessage()
+
+    async def run():
+        handle = dispatcher.track(message)
+        handle.report('1')
+        await asyncio.sleep(0.05)
+        handle.report('2')
+        await asyncio.sleep(0.05)
+        edits_before_interval = list(message.edits)
+        await asyncio.sleep(0.25)
+        await dispatcher.close()
+        return edits_before_interval
+
+    assert asyncio.run(run()) == ['1']
+    assert message.edits == ['1', '2']
+
+
+def test_flood_wait_pauses_and_retries():
+    dispatcher = ProgressDispatcher(global_rate=100, min_interval=0)
+    message = FakeMessage(fail_with=RetryAfter(0))
+
+    async def run():
+        handle = dispatcher.track(message)
+        handle.report('busy')
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+
+    asyncio.run(run())
+    assert dispatcher.flood_waits == 1
+    assert dispatcher.backoff > 1
+    assert message.edits == ['busy']
@@ -0,0 +1,166 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+import storage  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def manager(tmp_path, quota=100 * MB, wait_seconds=5.0):
+    return storage.StorageManager(str(tmp_path / 'work'), quota=quota, min_free=0, wait_seconds=wait_seconds)
+
+
+def write(path, nbytes):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(nbytes))
+
+
+def test_reservation_over_quota_is_rejected_at_once(tmp_path):
+    storage_manager = manager(tmp_path, quota=10 * MB)
+
+    async def run():
+        async with storage_manager.job('big') as job:
+            with pytest.raises(storage.StorageFull):
+                await job.reserve(11 * MB)
+            assert job.reserved == 0
+
+    asyncio.run(run())
+    assert storage_manager.rejected == 1
+
+
+def test_tracked_and_adopted_files_count_as_written(tmp_path):
+    storage_manager = manager(tmp_path)
+    partial = tmp_path / 'partial.bin'
+    thumb = tmp_path / 'thumb.jpg'
+
+    async def run():
+        async with storage_manager.job('job') as job:
+            await job.reserve(3 * MB)
+            job.track(str(partial))
+            job.adopt(str(thumb))
+            _free, usage = storage_manager._measure()
+            assert storage_manager._outstanding(usage) == 3 * MB
+
+            write(partial, 2 * MB)
+            write(thumb, MB)
+            _free, usage = storage_manager._measure()
+            # Everything reserved is on disk now, though none of it is in the job dir
+            assert usage['job'] >= 3 * MB
+            assert storage_manager._outstanding(usage) == 0
+
+    asyncio.run(run())
+    # Adopted files go with the job, tracked ones (resumable partials) stay
+    assert not thumb.exists()
+    assert partial.exists()
+
+
+def test_hard_links_are_counted_once(tmp_path):
+    storage_manager = manager(tmp_path)
+
+    async def run():
+        async with storage_manager.job('job') as job:
+            original = os.path.join(job.dir, 'video.mp4')
+            write(original, MB)
+            os.makedirs(os.path.join(job.dir, storage.HANDOFF_DIR))
+            os.link(original, os.path.join(job.dir, storage.HANDOFF_DIR, 'named.mp4'))
+            job.adopt(original)
+            assert MB <= job.usage() < 2 * MB
+
+    asyncio.run(run())
+
+
+def test_waiting_reservation_proceeds_when_a_job_ends(tmp_path):
+    storage_manager = manager(tmp_path, quota=10 * MB)
+    events = []
+
+    async def first(started):
+        async with storage_manager.job('first') as job:
+            await job.reserve(8 * MB)
+            started.set()
+            await asyncio.sleep(0.2)
+            events.append('first done')
+
+    async def second(started):
+        await started.wait()
+        async with storage_manager.job('second') as job:
+            waited = []
+
+            async def on_wait():
+                waited.append(True)
+
+            await job.reserve(5 * MB, on_wait)
+            events.append('second reserved')
+            assert waited
+
+    async def run():
+        started = asyncio.Event()
+        await asyncio.gather(first(started), second(started))
+
+    asyncio.run(run())
+    assert events == ['first done', 'second reserved']
+    assert storage_manager.reserved == 0
+
+
+def test_waiting_reservation_times_out(tmp_path):
+    storage_manager = manager(tmp_path, quota=10 * MB, wait_seconds=0.1)
+
+    async def run():
+        async with storage_manager.job('first') as first:
+            await first.reserve(8 * MB)
+            async with storage_manager.job('second') as second:
+                with pytest.raises(storage.StorageFull):
+                    await second.reserve(5 * MB)
+
+    asyncio.run(run())
+    assert storage_manager.rejected == 1
+
+
+def test_ytdlp_partials_survive_a_failed_job_and_the_sweep(tmp_path):
+    storage_manager = manager(tmp_path)
+    url = 'https://example.com/watch?v=1'
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with storage_manager.job('job') as job:
+                partial_dir = storage_manager.ytdlp_partial_dir(url)
+                job.track(partial_dir)
+                write(os.path.join(partial_dir, 'video.mp4.part'), MB)
+                write(os.path.join(job.dir, 'other.bin'), MB)
+                raise RuntimeError('download failed')
+        return partial_dir
+
+    partial_dir = asyncio.run(run())
+    leftover = os.path.join(storage_manager.root, 'leftover.bin')
+    write(leftover, 10)
+
+    kept = storage_manager.expire_ytdlp_partials(3600)
+    storage_manager.sweep(keep=kept)
+
+    assert kept == [partial_dir]
+    assert os.path.exists(os.path.join(partial_dir, 'video.mp4.part'))
+    assert not os.path.exists(leftover)
+    assert storage_manager.ytdlp_partial_dir(url) == partial_dir
+
+
+def test_stale_ytdlp_partials_expire_and_adopted_ones_go_with_the_job(tmp_path):
+    storage_manager = manager(tmp_path)
+    stale = storage_manager.ytdlp_partial_dir('https://example.com/old')
+    write(os.path.join(stale, 'old.part'), 10)
+    os.utime(os.path.join(stale, 'old.part'), (0, 0))
+    os.utime(stale, (0, 0))
+
+    assert storage_manager.expire_ytdlp_partials(3600) == []
+    assert not os.path.exists(stale)
+
+    async def run():
+        async with storage_manager.job('job') as job:
+            partial_dir = storage_manager.ytdlp_partial_dir('https://example.com/new')
+            write(os.path.join(partial_dir, 'frag1'), 10)
+            job.adopt(partial_dir)
+        return partial_dir
+
+    assert not os.path.exists(asyncio.run(run()))
@@ -1,14 +1,17 @@
-import os
 import asyncio
-from typing import Tuple
+from typing import Callable, Optional, Tuple
 
 from pyrogram import Client
 
-from config import API_ID, API_HASH, TG_SESSION_STRING, BRIDGE_CHANNEL_ID
-
-_pyro_client: Client | None = None
-_started = False
-_lock = asyncio.Lock()
+from config import (
+    API_ID,
+    API_HASH,
+    TG_SESSION_STRING,
+    BRIDGE_CHANNEL_ID,
+    BRIDGE_SESSION_STRINGS,
+    BRIDGE_MAX_UPLOADS,
+    BRIDGE_TRANSMISSIONS,
+)
 
 
 def _ensure_bridge_config():
@@ -16,25 +19,6 @@ def _ensure_bridge_config():
         raise RuntimeError("Bridge not configured: set TG_SESSION_STRING and BRIDGE_CHANNEL_ID in .env")
 
 
-async def _get_client() -> Client:
-    global _pyro_client, _started
-    _ensure_bridge_config()
-    async with _lock:
-        if _pyro_client is None:
-            # name can be anything; session_string is used
-            _pyro_client = Client(
-                name="bridge",
-                api_id=API_ID,
-                api_hash=API_HASH,
-                session_string=TG_SESSION_STRING,
-                no_updates=True,
-            )
-        if not _started:
-            await _pyro_client.start()
-            _started = True
-    return _pyro_client
-
-
 def _is_video(filename: str) -> bool:
     fn = filename.lower()
     return any(fn.endswith(ext) for ext in (
@@ -42,25 +26,128 @@ def _is_video(filename: str) -> bool:
     ))
 
 
-async def upload_to_bridge(file_path: str, filename: str, caption: str | None = None) -> Tuple[int, int]:
+class BridgeUploader:
     """
-    Uploads the file to the bridge channel using the user account (Pyrogram)
-    and returns (chat_id, message_id) of the uploaded message.
+    Pool of Pyrogram user-account clients that upload files to the bridge
+    channel, one per session string (a session is never connected twice). The
+    clients are started (connected and authorized) once at boot, and each file
+    goes to the least busy client. At most `max_uploads` files are uploaded at
+    once across the pool, and each client runs up to `transmissions` of them in
+    parallel (Pyrogram itself sends the parts of a large file over several
+    connections), so a single session already uploads several files at once.
     """
-    client = await _get_client()
 
-    if _is_video(filename):
-        msg = await client.send_video(
-            chat_id=BRIDGE_CHANNEL_ID,
-            video=file_path,
-            caption=caption,
-            supports_streaming=True,
-        )
-    else:
-        msg = await client.send_document(
-            chat_id=BRIDGE_CHANNEL_ID,
-            document=file_path,
-            caption=caption,
-        )
+    def __init__(self, sessions: Optional[list] = None, max_uploads: int = BRIDGE_MAX_UPLOADS,
+                 transmissions: int = BRIDGE_TRANSMISSIONS):
+        self.sessions = list(sessions if sessions is not None else BRIDGE_SESSION_STRINGS)
+        self.size = len(self.sessions)
+        self.max_uploads = max_uploads
+        self.transmissions = transmissions
+        self._clients: list = []
+        self._active: dict = {}
+        self._uploads = asyncio.Semaphore(max_uploads)
+        self._lock = asyncio.Lock()
+        self.uploads = 0
+        self.failures = 0
+        self.bytes_sent = 0
+
+    async def start(self):
+        """Connect the pool's clients; later calls return at once."""
+        _ensure_bridge_config()
+        async with self._lock:
+            if self._clients:
+                return
+            clients = [
+                Client(
+                    # name can be anything; session_string is used
+                    name=f"bridge{index}",
+                    api_id=API_ID,
+                    api_hash=API_HASH,
+                    session_string=session,
+                    no_updates=True,
+                    max_concurrent_transmissions=self.transmissions,
+                )
+                for index, session in enumerate(self.sessions)
+            ]
+            results = await asyncio.gather(*(client.start() for client in clients), return_exceptions=True)
+            for client, result in zip(clients, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️ Bridge client {client.name} failed to start: {result}")
+                else:
+                    self._clients.append(client)
+                    self._active[client] = 0
+            if not self._clients:
+                raise RuntimeError("No bridge client could connect")
+            print(f"🌉 Bridge uploader ready with {len(self._clients)} client(s)")
+
+    async def stop(self):
+        async with self._lock:
+            clients, self._clients = self._clients, []
+            self._active.clear()
+        await asyncio.gather(*(client.stop() for client in clients), return_exceptions=True)
+
+    async def upload(self, file_path: str, filename: str, caption: Optional[str] = None,
+                     thumb: Optional[str] = None,
+                     progress: Optional[Callable[[int, int], None]] = None,
+                     width: Optional[int] = None, height: Optional[int] = None,
+                     duration: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Uploads the file to the bridge channel and returns (chat_id, message_id)
+        of the uploaded message. `thumb` is an optional JPEG thumbnail path and
+        `progress(current, total)` is called on the event loop as parts are sent.
+        `width`, `height` and `duration` (from the probe) are sent with a video so
+        clients show it with the right aspect ratio and length.
+        """
+        await self.start()
+        if progress:
+            # Pyrogram runs plain callbacks on an executor thread; a coroutine
+            # is awaited on the loop, where the progress dispatcher lives
+            async def report(current, total):
+                progress(current, total)
+        else:
+            report = None
+        async with self._uploads:
+            client = min(self._clients, key=lambda c: self._active.get(c, 0))
+            self._active[client] = self._active.get(client, 0) + 1
+            try:
+                if _is_video(filename):
+                    msg = await client.send_video(
+                        chat_id=BRIDGE_CHANNEL_ID,
+                        video=file_path,
+                        caption=caption,
+                        supports_streaming=True,
+                        width=width or 0,
+                        height=height or 0,
+                        duration=duration or 0,
+                        thumb=thumb,
+                        progress=report,
+                    )
+                else:
+                    msg = await client.send_document(
+                        chat_id=BRIDGE_CHANNEL_ID,
+                        document=file_path,
+                        caption=caption,
+                        thumb=thumb,
+                        progress=report,
+                    )
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                if client in self._active:
+                    self._active[client] -= 1
+        self.uploads += 1
+        media = msg.video or msg.document
+        if media and media.file_size:
+            self.bytes_sent += media.file_size
+        return BRIDGE_CHANNEL_ID, msg.id
 
-    return BRIDGE_CHANNEL_ID, msg.id
+    def stats(self) -> dict:
+        return {
+            'clients': len(self._clients),
+            'busy': sum(self._active.values()),
+            'max_uploads': self.max_uploads,
+            'uploads': self.uploads,
+            'failures': self.failures,
+            'bytes_sent': self.bytes_sent,
+        }
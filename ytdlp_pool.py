@@ -0,0 +1,143 @@
+import asyncio
+import multiprocessing
+from typing import Awaitable, Callable, Optional
+
+import ytdlp_runner
+from config import YTDLP_WORKERS
+from info_cache import InfoCache
+
+# Seconds a worker gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE_SECONDS = 5
+
+
+class YtdlpProcessPool:
+    """
+    Runs yt-dlp jobs in dedicated worker processes, at most `max_workers` at a
+    time, so extraction and fragment handling never compete with the event
+    loop for the GIL. Cancelling run() (timeout, /cancel, shutdown) terminates
+    the worker, which stops its network transfer and file writes at once.
+    """
+
+    def __init__(self, max_workers: int = YTDLP_WORKERS, info_cache: Optional[InfoCache] = None):
+        self.max_workers = max_workers
+        self.info_cache = info_cache
+        self._slots = asyncio.Semaphore(max_workers)
+        # spawn: a fresh interpreter, no inherited event loop or writer threads
+        self._context = multiprocessing.get_context('spawn')
+        self.processes: set = set()
+        self.completed = 0
+        self.failed = 0
+        self.terminated = 0
+
+    async def run(
+        self,
+        url: str,
+        ydl_opts: dict,
+        temp_dir: str,
+        default_title: str = 'video',
+        cache_variant: str = '',
+        on_progress: Optional[Callable[[dict], None]] = None,
+        on_info: Optional[Callable[[dict], Awaitable[Optional[str]]]] = None,
+        timeout: Optional[float] = None,
+    ) -> tuple:
+        """
+        Extract and download `url` in a worker; returns (safe_title, estimated_size).
+        `on_info(info)` runs before any media is fetched; it may return a format
+        spec to download instead of the configured one, or raise to abort.
+        `timeout` starts once a worker slot is free and is paused while `on_info`
+        runs (it may wait for disk space), so only yt-dlp's own work counts; on
+        expiry the worker is terminated and asyncio.TimeoutError is raised.
+        """
+        # Hooks are closures of this process; the worker installs its own
+        ydl_opts = {k: v for k, v in ydl_opts.items() if k != 'progress_hooks'}
+        info = self.info_cache.get(url, cache_variant) if self.info_cache else None
+        async with self._slots:
+            return await self._run_worker(url, ydl_opts, temp_dir, default_title, cache_variant, info,
+                                          on_progress, on_info, timeout)
+
+    async def _run_worker(self, url, ydl_opts, temp_dir, default_title, cache_variant, info, on_progress, on_info,
+                          timeout):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=ytdlp_runner.worker_main,
+            args=(child_conn, url, ydl_opts, temp_dir, default_title, info),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.processes.add(process)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        finished = False
+        try:
+            while True:
+                try:
+                    receive = loop.run_in_executor(None, parent_conn.recv)
+                    if deadline is None:
+                        message = await receive
+                    else:
+                        # Expired deadline: wait_for times out at once and the worker is terminated below
+                        message = await asyncio.wait_for(receive, timeout=max(0, deadline - loop.time()))
+                except EOFError:
+                    raise Exception(f"yt-dlp worker exited unexpectedly (code {process.exitcode})")
+                kind = message[0]
+                if kind == 'progress':
+                    if on_progress:
+                        on_progress(message[1])
+                elif kind == 'info':
+                    if self.info_cache and info is None:
+                        self.info_cache.put(url, message[1], cache_variant)
+                    format_spec = None
+                    paused_at = loop.time()
+                    try:
+                        if on_info:
+                            format_spec = await on_info(message[1])
+                    except Exception as e:
+                        parent_conn.send(('abort', str(e)))
+                        raise
+                    if deadline is not None:
+                        # Waiting for disk space in on_info is not yt-dlp taking too long
+                        deadline += loop.time() - paused_at
+                    parent_conn.send(('go', format_spec))
+                elif kind == 'done':
+                    finished = True
+                    self.completed += 1
+                    return tuple(message[1])
+                elif kind == 'error':
+                    raise Exception(message[1])
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                self.failed += 1
+                # Likely expired format URLs or a changed page: extract afresh next time
+                if self.info_cache:
+                    self.info_cache.remove(url, cache_variant)
+            raise
+        finally:
+            self.processes.discard(process)
+            if finished:
+                await loop.run_in_executor(None, process.join, TERMINATE_GRACE_SECONDS)
+            if process.is_alive():
+                self.terminated += 1
+                await self._terminate(process)
+            parent_conn.close()
+
+    async def _terminate(self, process):
+        process.terminate()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, process.join, TERMINATE_GRACE_SECONDS)
+        if process.is_alive():
+            process.kill()
+            await loop.run_in_executor(None, process.join)
+
+    def shutdown(self):
+        for process in list(self.processes):
+            process.kill()
+
+    def stats(self) -> dict:
+        return {
+            'max_workers': self.max_workers,
+            'running': len(self.processes),
+            'completed': self.completed,
+            'failed': self.failed,
+            'terminated': self.terminated,
+        }
@@ -0,0 +1,98 @@
+import re
+import time
+import traceback
+from typing import Callable, Optional
+
+import yt_dlp
+
+# Minimum seconds between progress messages a worker sends to the bot
+PROGRESS_INTERVAL = 0.5
+
+# Progress fields worth sending across the process boundary
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta', 'filename')
+
+
+def safe_filename(title: str) -> str:
+    safe_title = re.sub(r'[<>:"/\\|?*]', '_', title)
+    if len(safe_title) > 100:
+        safe_title = safe_title[:100]
+    return safe_title
+
+
+def size_estimate(info: dict) -> Optional[int]:
+    """Expected download size of a yt-dlp info dict (all requested formats), if it says"""
+    formats = info.get('requested_formats') or [info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    if not all(sizes):
+        return None
+    return sum(sizes)
+
+
+def extract_and_download(
+    url: str,
+    ydl_opts: dict,
+    temp_dir: str,
+    default_title: str = 'video',
+    info: Optional[dict] = None,
+    before_download: Optional[Callable[[dict], Optional[str]]] = None,
+) -> tuple:
+    """
+    Run the extractor once (unless `info` from an earlier extraction is given),
+    then download from that info dict with an output template named after the
+    title. `before_download(info)` may return a format spec that replaces the
+    configured one. Blocking; returns (safe_title, estimated_size).
+    """
+    if info is None:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    else:
+        print(f"♻️ Reusing extracted info for {url}")
+
+    format_spec = before_download(info) if before_download else None
+
+    safe_title = safe_filename(info.get('title') or default_title)
+    # Relative template under paths['home'], so a configured paths['temp'] (where yt-dlp
+    # keeps .part and fragment files until they are complete) is honoured
+    download_opts = dict(ydl_opts, outtmpl=f'{safe_title}.%(ext)s',
+                         paths={**ydl_opts.get('paths', {}), 'home': temp_dir})
+    if format_spec:
+        download_opts['format'] = format_spec
+    with yt_dlp.YoutubeDL(download_opts) as ydl_download:
+        # Same path as --load-info-json: format selection and download, no second extraction
+        ydl_download.process_ie_result(info, download=True)
+    return safe_title, size_estimate(info) or 0
+
+
+def worker_main(conn, url: str, ydl_opts: dict, temp_dir: str, default_title: str, info: Optional[dict]):
+    """
+    Entry point of a yt-dlp worker process. Talks to the bot over `conn`:
+    sends ('info', info) and waits for ('go', format_spec) before downloading, then
+    ('progress', {...}) while downloading, and finally ('done', result) or
+    ('error', message).
+    """
+    last_sent = 0.0
+
+    def progress_hook(d):
+        nonlocal last_sent
+        now = time.time()
+        if d.get('status') == 'downloading' and now - last_sent < PROGRESS_INTERVAL:
+            return
+        last_sent = now
+        conn.send(('progress', {k: d.get(k) for k in PROGRESS_FIELDS}))
+
+    def before_download(extracted):
+        conn.send(('info', yt_dlp.YoutubeDL.sanitize_info(extracted)))
+        reply = conn.recv()
+        if reply[0] != 'go':
+            raise Exception(reply[1])
+        return reply[1]
+
+    try:
+        opts = dict(ydl_opts, progress_hooks=[progress_hook])
+        result = extract_and_download(url, opts, temp_dir, default_title, info, before_download)
+        conn.send(('done', result))
+    except Exception as e:
+        traceback.print_exc()
+        conn.send(('error', str(e)))
+    finally:
+        conn.close()